@@ -1,9 +1,46 @@
 class BaseFactory(object):
     """
     Object inherited class defines a POM structure
+    Stored objects are indexed by name, identity and by every class of their type,
+    so store/lookup/destroy do not scan the factory. Lookups by class keep the storing order
     @author: lex.khuat
     """
 
+    # ------ Private methods -------
+    def __index(self):
+        """
+        Return the registry: (name: object, id(object): name, class: {id(object): object})
+        """
+        index = self.__dict__.get('_BaseFactory__registry')
+        if index is None:
+            index = ({}, {}, {})
+            self.__dict__['_BaseFactory__registry'] = index
+        return index
+
+    def __unstore(self, name):
+        names, ids, types = self.__index()
+        obj = names.pop(name)
+        del ids[id(obj)]
+        for cls in type(obj).__mro__:
+            objects = types.get(cls)
+            if objects is not None:
+                objects.pop(id(obj), None)
+                if not objects:
+                    del types[cls]
+        return obj
+
+    def __copy__(self):
+        """
+        Shallow copy with its own registry: stored objects are shared,
+        but storing/destroying objects in the copy does not change this factory
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        names, ids, types = self.__index()
+        clone.__dict__['_BaseFactory__registry'] = (dict(names), dict(ids),
+                                                    dict((cls, dict(objects)) for cls, objects in types.items()))
+        return clone
+
     # ------ Public methods -------
     def getObj(self, classType, exclude=()):
         """
@@ -12,13 +49,43 @@ class BaseFactory(object):
         @param exclude: exclude items in return list
         @return: <List>Object
         """
-        return list(item for item in self.__dict__.values()
-                    if isinstance(item, classType)
-                    and item not in exclude)
+        objects = self.__index()[2].get(classType)
+        if not objects:
+            return []
+        if exclude:
+            excluded = set(id(item) for item in exclude)
+            return [item for key, item in objects.items() if key not in excluded]
+        return list(objects.values())
+
+    def getByName(self, name, classType=object):
+        """
+        Return a stored instance by its name
+        @param name: instance name
+        @param classType: expected class of the instance
+        @return: Object, None if not stored or not a classType instance
+        """
+        obj = self.__index()[0].get(name)
+        return obj if isinstance(obj, classType) else None
+
+    def nameOf(self, obj):
+        """
+        Return the name an instance is stored under
+        @param obj: stored object
+        @return: name, None if not stored
+        """
+        return self.__index()[1].get(id(obj))
+
+    def storedItems(self):
+        """
+        Return all stored instances with their names in storing order
+        @return: <List>(name, Object)
+        """
+        return list(self.__index()[0].items())
 
     def storeObj(self, name, obj, classType):
         """
         Add a class instance by classType
+        An instance already stored under this name is replaced
         @param name: instance name
         @param obj: object to add
         @param classType: type of returned class
@@ -26,12 +93,18 @@ class BaseFactory(object):
         """
         if not isinstance(obj, classType):
             raise ValueError('%s must be %s classtype' % (obj, classType))
-        for k, v in self.__dict__.items():
-            if v is obj:
-                if k is not name:
-                    raise Exception('%s object already stored under another name: %s' % (obj, k))
-                else:
-                    return self
+        names, ids, types = self.__index()
+        stored = ids.get(id(obj))
+        if stored is not None:
+            if stored != name:
+                raise Exception('%s object already stored under another name: %s' % (obj, stored))
+            return self
+        if name in names:
+            self.__unstore(name)
+        names[name] = obj
+        ids[id(obj)] = name
+        for cls in type(obj).__mro__:
+            types.setdefault(cls, {})[id(obj)] = obj
         self.__setattr__(name, obj)
         return self
 
@@ -41,11 +114,9 @@ class BaseFactory(object):
         @param object: instance to destroy
         @return: self
         """
-        name, val = None, None
-        for k, v in self.__dict__.items():
-            if v is object:
-                name = k, val = v
-                break
-        if name not in (None, 'siteName'):
-            delattr(self, val)
+        name = self.nameOf(object)
+        if name is not None:
+            self.__unstore(name)
+            if self.__dict__.get(name) is object:
+                delattr(self, name)
         return self
@@ -1,7 +1,15 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import threading
 from datetime import datetime
-from time import time, sleep
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import sleep
+from core.libs.ResultSink import ResultSink
+from core.libs.Timer import Timer
 
 
 class Scenario(tuple):
@@ -31,29 +39,137 @@ class Scenario(tuple):
         return scenario
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as JSON lines
+    @author: lex.khuat
+    """
+
+    def format(self, record):
+        data = {'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage()}
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler keeping the traceback apart from the message (QueueHandler.prepare merges them),
+    so formatters of the listener can still write it in their own field
+    @author: lex.khuat
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RoutingHandler(logging.Handler):
+    """
+    Write records to the file handler of their logger (one log file per test class)
+    Runs in the background thread of the QueueListener
+    @author: lex.khuat
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.routes = {}
+
+    def addRoute(self, name, handler):
+        self.routes[name] = handler
+
+    def emit(self, record):
+        flushed = getattr(record, 'flushed', None)
+        if flushed is not None:
+            self.flush()
+            flushed.set()
+            return
+        handler = self.routes.get(record.name)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+
+    def flush(self):
+        for handler in list(self.routes.values()):
+            handler.flush()
+
+    def closeFiles(self):
+        """
+        Close log files, they are reopened (appended) by the next record
+        """
+        for handler in list(self.routes.values()):
+            handler.close()
+
+
 class TestLog:
     """
     Test base class provide all methods support test logging to files
+    Records are put into a queue and written by a background thread (QueueListener),
+    so logging inside timed sections does not do disk I/O on the test thread
     @author: lex.khuat
     """
     log = logging.getLogger(__name__)
     logPath = '.'
+    logFormat = '%(asctime)s : %(levelname)s : %(message)s'
+    jsonLines = False
+    maxBytes = 10 * 1024 * 1024
+    backupCount = 5
+    __queue = None
+    __router = None
+    __listener = None
+    __lock = threading.Lock()
 
-    def setLogPath(self, dirpath=None):
+    @staticmethod
+    def __start():
+        with TestLog.__lock:
+            if TestLog.__queue is None:
+                TestLog.__queue = queue.SimpleQueue()
+                TestLog.__router = RoutingHandler()
+                atexit.register(TestLog.stopLogging)
+            if TestLog.__listener is None:
+                TestLog.__listener = QueueListener(TestLog.__queue, TestLog.__router)
+                TestLog.__listener.start()
+        return TestLog.__queue, TestLog.__router
+
+    def setLogPath(self, dirpath=None, jsonLines=None):
         """
-        Set dir path to export log file
+        Set dir path to export log file, each test class logs into its own file
         @param dirpath: directory path to log file
+        @param jsonLines: write structured JSON lines instead of text (class jsonLines if none)
         @return: self
         """
         if dirpath is not None:
             self.logPath = os.path.realpath(dirpath)
-        if not self.log.handlers:
-            file_path = '%s\\%s_%s.log' \
-                        % (self.logPath, self.__class__.__name__, datetime.now().strftime("%Y%m%d_%H%M%S"))
-            formatter = logging.Formatter('%(asctime)s : %(levelname)s : %(message)s')
-            file_handler = logging.FileHandler(file_path)
-            file_handler.setFormatter(formatter)
-            self.log.addHandler(file_handler)
+        cls = self.__class__
+        log = logging.getLogger('%s.%s' % (__name__, cls.__name__))
+        # (Re)start the background writer, records logged since stopLogging are written
+        logQueue, router = self.__start()
+        if not log.handlers:
+            jsonLines = self.jsonLines if jsonLines is None else jsonLines
+            os.makedirs(self.logPath, exist_ok=True)
+            file_path = os.path.join(self.logPath, '%s_%s.%s' % (cls.__name__,
+                                                                 datetime.now().strftime("%Y%m%d_%H%M%S"),
+                                                                 'jsonl' if jsonLines else 'log'))
+            file_handler = RotatingFileHandler(file_path, maxBytes=self.maxBytes, backupCount=self.backupCount,
+                                               delay=True)
+            file_handler.setFormatter(JsonFormatter() if jsonLines else logging.Formatter(self.logFormat))
+            router.addRoute(log.name, file_handler)
+            log.propagate = False
+            log.addHandler(RecordQueueHandler(logQueue))
+        cls.log = log
         return self
 
     def setLogLevel(self, level):
@@ -65,25 +181,93 @@ class TestLog:
         self.log.setLevel(level)
         return self
 
+    @staticmethod
+    def flushLogs(timeout=10):
+        """
+        Wait until records queued so far are written and log files are flushed
+        @param timeout: max seconds to wait
+        @return: True if flushed before timeout
+        """
+        if TestLog.__listener is None:
+            return True
+        flushed = threading.Event()
+        TestLog.__queue.put(logging.makeLogRecord({'name': __name__, 'flushed': flushed}))
+        return flushed.wait(timeout)
+
+    @staticmethod
+    def stopLogging():
+        """
+        Stop the background writer after writing queued records, and close log files (called at exit)
+        Records logged afterwards are written when setLogPath starts the writer again
+        """
+        with TestLog.__lock:
+            listener = TestLog.__listener
+            TestLog.__listener = None
+        if listener is not None:
+            listener.stop()
+            TestLog.__router.closeFiles()
+
+
+class ClassProperty(object):
+    """
+    Read-only property which can be read from a class or its instances
+    @author: lex.khuat
+    """
+
+    def __init__(self, getter):
+        self.getter = getter
+        self.__doc__ = getter.__doc__
+
+    def __get__(self, instance, owner):
+        return self.getter(owner)
+
+    def __set__(self, instance, value):
+        raise AttributeError('Read-only property')
+
 
 class BaseTest(object):
     """
     Base test class provide all methods support functionality test
     @author: lex.khuat
     """
-    testResults = []
 
     @classmethod
     def add_testResult(cls, scenario, actual, expect):
         """
         Store test result for later check
+        Results go to the ResultSink of the process, flushed to a per-worker file (see core.libs.ResultSink)
         @param scenario: description of the test scenario
         @param actual: actual value
         @param expect: expect value
         """
-        cls.testResults.append({'Scenario': str(scenario),
-                                 'Actual': actual,
-                                 'Expect': expect})
+        ResultSink.default().add(scenario, actual, expect)
+
+    @classmethod
+    def get_testResults(cls):
+        """
+        Return test results stored by this process
+        @return: <List>dict of Scenario, Actual, Expect
+        """
+        return ResultSink.default().results()
+
+    def testResults(cls):
+        """
+        Test results stored by this process (read-only, see get_testResults)
+        @return: <List>dict of Scenario, Actual, Expect
+        """
+        return cls.get_testResults()
+
+    testResults = ClassProperty(testResults)
+
+    @classmethod
+    def add_tableResult(cls, scenario, diff):
+        """
+        Store every difference found by Table.diff as a test result
+        @param scenario: description of the test scenario
+        @param diff: <TableDiff> result of actualTable.diff(expectTable, keys)
+        """
+        for item in diff.results(scenario):
+            cls.add_testResult(*item)
 
     @staticmethod
     def sleep(seconds):
@@ -110,10 +294,33 @@ class BaseDBTest(BaseTest):
 class BaseUIPerformanceTest(BaseUITest):
     """
     Base test class provide all methods support UI performance test
+    Each test instance owns a Timer (perf_counter_ns checkpoints), started by setup_method when the test starts.
+    reset() starts another run of the same flow
+    perfBudgets: allowed relative slowdown per checkpoint ('*' for others) checked by the core.libs.PerfGate plugin
     @author: lex.khuat
     """
+    perfBudgets = {}
 
-    checkPoints = [{'name': 'start', 'laptime': time()}]
+    def timer(self):
+        """
+        Return the checkpoint timer of this test instance
+        @return: <Timer>
+        """
+        timer = self.__dict__.get('_BaseUIPerformanceTest__timer')
+        if timer is None:
+            timer = self.__timer = Timer()
+        return timer
+
+    timer = property(timer)
+
+    def checkPoints(self):
+        """
+        Return checkpoints of the current run
+        @return: <List>dict of name & laptime (seconds)
+        """
+        return [{'name': name, 'laptime': ns / 1e9} for name, ns in self.timer.checkpoints()]
+
+    checkPoints = property(checkPoints)
 
     def index(self, checkpoint):
         """
@@ -121,45 +328,77 @@ class BaseUIPerformanceTest(BaseUITest):
         @param checkpoint: checkpoint name
         @return: int as index of the checkpoint
         """
-        for i, v in enumerate(self.checkPoints):
-            if v['name'] == checkpoint:
-                return i
-        return None
+        return self.timer.index(checkpoint)
+
+    def setup_method(self, method=None):
+        """
+        Start the timer when the test starts (called by pytest before each test method),
+        subclasses overriding it must call super().setup_method(method)
+        """
+        self.reset()
 
     def reset(self):
         """
-        Reset test time counter
+        Reset test time counter, starting a new run (previous run is kept for statistics)
         @return: self
         """
-        self.checkPoints = [{'name': 'start', 'laptime': time()}]
+        self.timer.reset()
         return self
 
-    def lap(self, checkpoint=None):
+    def lap(self, checkpoint=None, engine=None):
         """
         Record the eplapsed time from the last record
         @param checkpoint: name of the checkpoint to record
+        @param engine: <WebDriver> collecting performance timings, its timings since the last lap
+                       are attached to the checkpoint
         @return: self
         """
-        if checkpoint in [i['name'] for i in self.checkPoints]:
-            raise Exception('Checkpoint name already exists')
-        if checkpoint is None:
-            checkpoint = str(len(self.checkPoints))
-        self.checkPoints.append({'name': str(checkpoint), 'laptime': time()})
+        if self.__dict__.get('_BaseUIPerformanceTest__timer') is None:
+            raise Exception('Timer is not started, call reset() (or setup_method) before the first lap')
+        details = None
+        if engine is not None:
+            details = {'browser': engine.pop_performance_timings()}
+        self.timer.lap(checkpoint, details)
         return self
 
-    def eplapse(self, check=None, lastcheck=None):
+    def breakdown(self, check=None):
+        """
+        Split the duration of a checkpoint into page cost (navigation durations measured by the browser)
+        and harness cost (the rest: WebDriver wire calls & python)
+        @param check: checkpoint recorded with an engine (last checkpoint if none)
+        @return: dict of total, page, harness (seconds)
+        """
+        check = self.timer.checkpoints()[-1][0] if check is None else str(check)
+        total = self.timer.elapsed(check)
+        details = self.timer.details(check) or {}
+        page = sum(entry.get('duration', 0) for timing in details.get('browser', [])
+                   for entry in timing.get('navigation', [])) / 1000.0
+        return {'total': total, 'page': page, 'harness': total - page}
+
+    def elapsed(self, check=None, lastcheck=None):
         """
         Get the duration between 2 checkpoint
         @param check: to checkpoint (last checkpoint if none)
         @param lastcheck: from checkpoint (to checkpoint - 1) if none
         @return: duration
         """
-        check = self.checkPoints[-1] if check is None \
-            else self.checkPoints[self.index(check)]
-        lastcheck = self.checkPoints[self.index(check['name']) - 1] if lastcheck is None \
-            else self.checkPoints[self.index(lastcheck)]
-        duration = check['laptime'] - lastcheck['laptime']
-        self.log.info(check['name'] + ' in {:0.2f} seconds'.format(duration))
+        duration = self.timer.elapsed(check, lastcheck)
+        name = self.timer.checkpoints()[-1][0] if check is None else str(check)
+        self.log.info(name + ' in {:0.3f} seconds'.format(duration))
         return duration
 
+    def eplapse(self):
+        """
+        Get the duration of the last checkpoint
+        @return: duration
+        """
+        return self.elapsed()
+
     eplapse = property(eplapse)
+
+    def stats(self):
+        """
+        Return min/median/p95/p99/stdev of each checkpoint over all runs of this test
+        @return: dict of checkpoint: statistics
+        """
+        return self.timer.stats()
@@ -1,8 +1,18 @@
-from contextlib import contextmanager
-from sqlalchemy import create_engine
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager, contextmanager
+from pandas import DataFrame
+from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
 from core.abstract.BaseFactory import BaseFactory
+from core.models.Table import Table
 
 
 class DBApi(object):
@@ -21,10 +31,20 @@ class Server(object):
     """
     conApi = None
 
-    def __init__(self, dialect, ip, port=3306):
+    def __init__(self, dialect, ip, port=3306, **poolOptions):
         self.dialect = dialect
         self.ip = ip
         self.port = port
+        self.poolOptions = poolOptions
+
+    def setPoolOptions(self, **poolOptions):
+        """
+        Set connection pool options of engines built on this server (pool_size, max_overflow, pool_recycle...)
+        @param poolOptions: keyword args of sqlalchemy create_engine
+        @return: self
+        """
+        self.poolOptions.update(poolOptions)
+        return self
 
 
 class DataBase(object):
@@ -47,13 +67,314 @@ class DBUser(object):
         self.password = password
 
 
+class QueryResult(object):
+    """
+    Data abstract interface class defines the result of a query run on one database
+    """
+    table = None
+    error = None
+    elapsed = None
+
+    def __init__(self, database):
+        self.database = database
+
+    def succeeded(self):
+        return self.error is None
+
+    succeeded = property(succeeded)
+
+
+class LoadReport(object):
+    """
+    Data abstract interface class defines the report of a bulk load
+    """
+
+    def __init__(self, tableName, method, rows, seconds):
+        self.tableName = tableName
+        self.method = method
+        self.rows = rows
+        self.seconds = seconds
+
+    def rowsPerSecond(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    rowsPerSecond = property(rowsPerSecond)
+
+
+class QueryCache(object):
+    """
+    Data abstract interface class defines a cache of read-only query results
+    Entries expire after ttl seconds, least recently used entries are evicted over maxEntries/maxBytes
+    """
+    IDENTIFIER = r'(?:`[^`]*`|"[^"]*"|\[[^\]]*\]|\w+)'
+    TOKENS = re.compile(r"'(?:[^']|'')*'|%s(?:\s*\.\s*%s)*|[(),;]|[^\s\w(),;'`\"\[]+" % (IDENTIFIER, IDENTIFIER))
+    NAME = re.compile(r'%s(?:\s*\.\s*%s)*$' % (IDENTIFIER, IDENTIFIER))
+    # Keywords ending a FROM table list
+    LIST_END = ('WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW', 'FOR', ';')
+    # Tag of queries whose tables could not be parsed, dropped by any invalidation
+    ANY_TABLE = '*'
+
+    def __init__(self, ttl=300, maxEntries=256, maxBytes=64 * 2 ** 20):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key(engine: Engine, sql, params=None):
+        """
+        Return the cache key of a query
+        @return: tuple of engine url, sql text, bound params
+        """
+        return str(engine.url), str(sql), repr(sorted((params or {}).items()))
+
+    @staticmethod
+    def name(identifier):
+        """
+        Return the lowercase table name of an identifier, without schema and quotes
+        """
+        return re.split(r'\s*\.\s*', identifier)[-1].strip('`"[]').lower()
+
+    @staticmethod
+    def tables(sql):
+        """
+        Return lowercase names of tables read by a query: FROM lists (comma separated) and JOIN clauses,
+        at any subquery level. Returns {ANY_TABLE} if a table reference can not be parsed or none is found
+        @return: <Set>
+        """
+        names = set()
+        depth = 0
+        lists = []  # depths of the open FROM lists
+        expect = False
+        for token in QueryCache.TOKENS.findall(str(sql)):
+            word = token.upper()
+            if expect:
+                expect = False
+                if token == '(':
+                    # Derived table: its own FROM clauses are parsed as well
+                    depth += 1
+                elif QueryCache.NAME.match(token) and word not in ('SELECT', 'LATERAL'):
+                    names.add(QueryCache.name(token))
+                else:
+                    return {QueryCache.ANY_TABLE}
+                continue
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                while lists and lists[-1] > depth:
+                    lists.pop()
+            elif word == 'FROM':
+                expect = True
+                lists.append(depth)
+            elif word == 'JOIN':
+                expect = True
+            elif lists and lists[-1] == depth:
+                if token == ',':
+                    expect = True
+                elif word in QueryCache.LIST_END:
+                    lists.pop()
+        if expect or not names:
+            return {QueryCache.ANY_TABLE}
+        return names
+
+    def get(self, key):
+        """
+        Return a copy of the cached table of a key
+        @return: <Table>, None if not cached or expired
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self.__remove(key)
+                self.__stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.__stats['misses'] += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__stats['hits'] += 1
+            table = entry[3]
+        return Table(table.copy())
+
+    def put(self, key, sql, table, ttl=None):
+        """
+        Store a copy of a query result
+        @param key: cache key of the query
+        @param sql: query text, used to find the tables it depends on
+        @param table: <Table> result
+        @param ttl: seconds to keep the entry (cache ttl if none)
+        @return: self
+        """
+        table = Table(table.copy())
+        size = int(table.memory_usage(index=True, deep=True).sum())
+        if size > self.maxBytes:
+            return self
+        expire = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (expire, self.tables(sql), size, table)
+            self.__size += size
+            while len(self.__entries) > self.maxEntries or self.__size > self.maxBytes:
+                self.__remove(next(iter(self.__entries)))
+                self.__stats['evictions'] += 1
+        return self
+
+    def __remove(self, key):
+        self.__size -= self.__entries.pop(key)[2]
+
+    def invalidate(self, tableName=None):
+        """
+        Drop cached results depending on a table, or all results
+        @param tableName: table name written by a test (all entries if none)
+        @return: number of dropped entries
+        """
+        name = None if tableName is None else self.name(tableName)
+        with self.__lock:
+            keys = [key for key, entry in self.__entries.items()
+                    if name is None or name in entry[1] or self.ANY_TABLE in entry[1]]
+            for key in keys:
+                self.__remove(key)
+            self.__stats['invalidations'] += len(keys)
+        return len(keys)
+
+    def stats(self):
+        """
+        Return hits, misses, expired, evictions, invalidations counters and current entries/bytes
+        @return: dict
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats.update({'entries': len(self.__entries), 'bytes': self.__size})
+        return stats
+
+
 class DataFactory(BaseFactory):
     """
     Object inherited class defines a POM structure simulate a database system to test
     DataFactory object holds:
     - An attached SqlAlchemy engine to produce & control db connection tests (inherited Session class)
+    Engines are cached by connection and options for the whole session, shared by all factories
     @author: lex.khuat
     """
+    defaultPoolOptions = {'pool_pre_ping': True, 'pool_recycle': 3600}
+    __isolated = None
+    queryCache = None
+    ASYNC_APIS = {'mysql': 'aiomysql', 'sqlite': 'aiosqlite'}
+    LOAD_METHODS = ('auto', 'executemany', 'multirow', 'infile')
+    # Max bound parameters per statement of dialects which limit them
+    MAX_PARAMS = {'sqlite': 999}
+    __engines = {}
+    __stats = {}
+    __lock = threading.Lock()
+
+    # ------ Private methods -------
+    @classmethod
+    def __record_wait(cls, engine, seconds):
+        with cls.__lock:
+            stats = cls.__stats.setdefault(engine, {'connects': 0, 'waitTime': 0.0, 'maxWait': 0.0})
+            stats['connects'] += 1
+            stats['waitTime'] += seconds
+            stats['maxWait'] = max(stats['maxWait'], seconds)
+
+    def __is_isolated(self, connection):
+        return bool(self.__isolated) and any(connection is shared for shared, owner in self.__isolated.values())
+
+    @staticmethod
+    def __is_caller_transaction(connection):
+        # A transaction the caller opened ("with connection.begin():") stays under its control, while an autobegun
+        # one (sqlalchemy 1.4+) has no owner. Before 1.4 there is no autobegin, any transaction is the caller's
+        if not connection.in_transaction():
+            return False
+        if not hasattr(connection, 'get_transaction'):
+            return True
+        connection = getattr(connection, 'sync_connection', connection)
+        return getattr(connection, '_trans_context_manager', None) is not None
+
+    def __validate(self, database: DataBase, user: DBUser):
+        if not isinstance(database, DataBase):
+            raise ValueError('%s must be %s classtype' % (database, DataBase))
+        if not isinstance(user, DBUser):
+            raise ValueError('%s must be %s classtype' % (user, DBUser))
+        if self.nameOf(database) is None:
+            raise LookupError('%s is not stored in factory' % database.dbName)
+        if self.nameOf(user) is None:
+            raise LookupError('%s is not stored in factory' % user.username)
+
+    def __url(self, database: DataBase, user: DBUser, api=None):
+        if api is None and database.server.conApi is not None:
+            api = database.server.conApi.name
+        if database.server.dialect == 'sqlite':
+            # Sqlite databases are files (dbName is the file path or :memory:), no host & credentials
+            return 'sqlite{}:///{}'.format('' if api is None else '+%s' % api, database.dbName)
+        return '{}{}://{}:{}@{}:{}/{}'.format(
+            database.server.dialect,
+            '' if api is None else '+%s' % api,
+            user.username,
+            user.password,
+            database.server.ip,
+            database.server.port,
+            database.dbName)
+
+    def __options(self, database: DataBase, kwargs):
+        options = dict(self.defaultPoolOptions)
+        options.update(database.server.poolOptions)
+        options.update(kwargs)
+        return options
+
+    def __engine(self, database: DataBase, user: DBUser, **kwargs):
+        """
+        Return the cached engine of database & user, create it if needed
+        """
+        conStr = self.__url(database, user)
+        options = self.__options(database, kwargs)
+        key = (conStr, repr(sorted(options.items())))
+        with self.__lock:
+            newEngine = self.__engines.get(key)
+            if newEngine is None:
+                newEngine = create_engine(conStr, **options)
+                self.__engines[key] = newEngine
+        return newEngine
+
+    @staticmethod
+    def __rows(data, columns, chunkSize):
+        """
+        Return column names and an iterator of row tuples from a Table/DataFrame or an iterable of rows (dict/tuple)
+        Frames are converted to python values (NaN/NaT as None) chunk by chunk
+        """
+        if isinstance(data, DataFrame):
+            columns = list(data.columns) if columns is None else list(columns)
+            frame = data[columns]
+
+            def frame_rows():
+                for start in range(0, len(frame), chunkSize):
+                    chunk = frame.iloc[start:start + chunkSize].astype(object)
+                    for row in chunk.where(chunk.notnull(), None).itertuples(index=False, name=None):
+                        yield row
+            return columns, frame_rows()
+        rows = iter(data)
+        first = next(rows, None)
+        if first is None:
+            return list(columns or []), iter(())
+        rows = itertools.chain([first], rows)
+        if isinstance(first, dict):
+            columns = list(first) if columns is None else list(columns)
+            return columns, (tuple(row.get(col) for col in columns) for row in rows)
+        if columns is None:
+            raise ValueError('Columns are required to load rows of values')
+        return list(columns), rows
+
+    @staticmethod
+    def __csv_value(value):
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        return '"%s"' % str(value).replace('"', '""')
 
     # ------ Public methods -------
     def addDBApi(self, name, type):
@@ -90,16 +411,14 @@ class DataFactory(BaseFactory):
         """
         if not isinstance(dbObj, DataBase):
             raise ValueError('%s must be %s classtype' % (dbObj, DataBase))
-        for key, val in self.__dict__.items():
-            if key == svName:
-                if not isinstance(val, Server):
-                    raise LookupError('%s is not a server classtype' % key)
-                else:
-                    dbObj.server = val
-                    val.__setattr__(dbObj.dbName, dbObj)
-                    self.storeObj(dbObj.dbName, dbObj, DataBase)
-                    return self
-        return self
+        server = self.getByName(svName)
+        if server is None:
+            return self
+        if not isinstance(server, Server):
+            raise LookupError('%s is not a server classtype' % svName)
+        dbObj.server = server
+        server.__setattr__(dbObj.dbName, dbObj)
+        return self.storeObj(dbObj.dbName, dbObj, DataBase)
 
     def addUser(self, userObj: DBUser):
         """
@@ -159,35 +478,273 @@ class DataFactory(BaseFactory):
         @param kwargs: more keyword args from https://docs.sqlalchemy.org/en/13/core/engines.html
         @return: <Engine> newEngine
         """
-        if not isinstance(database, DataBase):
-            raise ValueError('%s must be %s classtype' % (database, DataBase))
-        if not isinstance(user, DBUser):
-            raise ValueError('%s must be %s classtype' % (user, DBUser))
-        if database not in self.storedDatabases:
-            raise LookupError('%s is not stored in factory' % database.dbName)
-        if user not in self.storedUsers:
-            raise LookupError('%s is not stored in factory' % user.username)
-        conStr = '{}{}://{}:{}@{}:{}/{}'.format(
-            database.server.dialect,
-            '' if database.server.conApi.name is None else '+%s' % database.server.conApi.name,
-            user.username,
-            user.password,
-            database.server.ip,
-            database.server.port,
-            database.dbName)
-        newEngine = create_engine(conStr, **kwargs)
-        self.__setattr__(name, newEngine)
+        self.__validate(database, user)
+        newEngine = self.__engine(database, user, **kwargs)
+        if self.nameOf(newEngine) is None:
+            self.storeObj(name, newEngine, Engine)
+        else:
+            # Same cached engine built again under another name
+            self.__setattr__(name, newEngine)
         return newEngine
 
+    def buildAsyncEngine(self, name: str, database: DataBase, user: DBUser, api=None, **kwargs):
+        """
+        Build a new asyncio engine (sqlalchemy.ext.asyncio, sqlalchemy 1.4+) to work with database
+        Async engines are not cached: their connection pool belongs to the event loop they are used in
+        @param name: name the new engine
+        @param database: database to connect, must be stored in factory first
+        @param user: user to connect, must be stored in factory first
+        @param api: async driver api (aiomysql for mysql, aiosqlite for sqlite if none)
+        @param kwargs: more keyword args from https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html
+        @return: <AsyncEngine> newEngine
+        """
+        from sqlalchemy.ext.asyncio import create_async_engine
+        self.__validate(database, user)
+        if api is None:
+            api = self.ASYNC_APIS.get(database.server.dialect)
+            if api is None:
+                raise LookupError('No default async api for %s dialect' % database.server.dialect)
+        newEngine = create_async_engine(self.__url(database, user, api), **self.__options(database, kwargs))
+        self.storeObj(name, newEngine, type(newEngine))
+        return newEngine
+
+    def poolStats(self, engine: Engine):
+        """
+        Return connection pool statistics of an engine
+        - size, checkedIn, checkedOut, overflow: current pool state (None if not supported by the pool class)
+        - connects, waitTime, maxWait: connections taken through connect/dbapi_connect and seconds waited for them
+        @param engine: <Engine>db engine
+        @return: dict
+        """
+        pool = engine.pool
+        stats = {'pool': pool.__class__.__name__}
+        for name, method in (('size', 'size'), ('checkedIn', 'checkedin'),
+                             ('checkedOut', 'checkedout'), ('overflow', 'overflow')):
+            stats[name] = getattr(pool, method)() if hasattr(pool, method) else None
+        with self.__lock:
+            stats.update(self.__stats.get(engine, {'connects': 0, 'waitTime': 0.0, 'maxWait': 0.0}))
+        return stats
+
+    @classmethod
+    def dispose_all(cls):
+        """
+        Close connection pools of all cached engines, use at session teardown
+        """
+        with cls.__lock:
+            engines = list(cls.__engines.values())
+            cls.__engines.clear()
+            cls.__stats.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def fan_out(self, query, user: DBUser, databases=None, params=None, timeout=None, maxWorkers=8, **kwargs):
+        """
+        Run the same query concurrently on many databases using a bounded thread pool
+        Errors and timeouts are captured per database instead of aborting the batch
+        Engines in an isolated session are refused (ValueError): its connection can not be shared by workers
+        @param query: sql text, or function taking a connection and returning a ResultProxy/Table/DataFrame
+        @param user: user to connect, must be stored in factory first
+        @param databases: list of databases to query (all stored databases if none)
+        @param params: bound parameters of sql text query
+        @param timeout: seconds allowed for each database, counted from the start of its query.
+                        A timed out query is abandoned (left running in its worker) and reported as TimeoutError
+        @param maxWorkers: max number of databases queried at the same time
+        @param kwargs: more keyword args of buildEngine
+        @return: <List>QueryResult in order of databases, result table is tagged with attrs['database']
+        """
+        databases = list(self.storedDatabases if databases is None else databases)
+        results = [QueryResult(database) for database in databases]
+        if not databases:
+            return results
+        engines = {}
+        for index, database in enumerate(databases):
+            try:
+                engines[index] = self.__engine(database, user, **kwargs)
+            except Exception as e:
+                results[index].error = e
+                continue
+            if self.__isolated and engines[index] in self.__isolated:
+                raise ValueError('%s is in an isolated session, its connection can not be shared by fan_out workers'
+                                 % database.dbName)
+        if not engines:
+            return results
+        started = {}
+
+        def run(index, database):
+            started[index] = time.monotonic()
+            with self.connect(engines[index]) as connection:
+                value = query(connection) if callable(query) else connection.execute(text(query), params or {})
+                if value is None or (not isinstance(value, Table) and getattr(value, 'returns_rows', True) is False):
+                    table = None
+                else:
+                    table = value if isinstance(value, Table) else Table(value)
+                    table.attrs['database'] = database.dbName
+            return table, time.monotonic() - started[index]
+
+        workers = min(maxWorkers, len(engines))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(run, i, databases[i]): i for i in engines}
+        pending = set(futures)
+        abandoned = set()
+        try:
+            while pending:
+                waitFor = None
+                if timeout is not None:
+                    now = time.monotonic()
+                    for future in list(pending):
+                        index = futures[future]
+                        if index in started and now - started[index] >= timeout:
+                            pending.discard(future)
+                            abandoned.add(future)
+                            results[index].error = TimeoutError('Query timed out after %s seconds' % timeout)
+                            results[index].elapsed = now - started[index]
+                    if len([f for f in abandoned if not f.done()]) >= workers:
+                        # All workers hang on timed out queries, queued databases can not start anymore
+                        for future in pending:
+                            future.cancel()
+                            results[futures[future]].error = TimeoutError('Query not started, all workers timed out')
+                        break
+                    remaining = [timeout - (now - started[futures[f]]) for f in pending if futures[f] in started]
+                    waitFor = max(min(remaining), 0) if remaining else timeout
+                done, pending = wait(pending, timeout=waitFor, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        results[index].table, results[index].elapsed = future.result()
+                    except Exception as e:
+                        results[index].error = e
+                        if index in started:
+                            results[index].elapsed = time.monotonic() - started[index]
+        finally:
+            executor.shutdown(wait=False)
+        return results
+
+    def bulk_load(self, engine: Engine, tableName: str, data, columns=None, method='auto', batchSize=1000):
+        """
+        Insert many rows into a table in one transaction using the fastest available path
+        - executemany: chunked executemany of a single row insert (default, any dialect)
+        - multirow: one INSERT ... VALUES (...), (...) statement per batch (default for mysql)
+        - infile: LOAD DATA LOCAL INFILE from a temp csv file (mysql only,
+                  the engine must allow it: connect_args={'local_infile': True})
+        @param engine: <Engine>db engine
+        @param tableName: name of the table to load, may be prefixed by schema
+        @param data: <Table>/DataFrame, or iterable of dict rows or tuple rows (columns required)
+        @param columns: column names to load (all frame columns/dict keys if none)
+        @param method: auto, executemany, multirow or infile
+        @param batchSize: number of rows per statement/executemany call
+        @return: <LoadReport>
+        """
+        if method not in self.LOAD_METHODS:
+            raise ValueError('Load method must be one of %s: %s' % (self.LOAD_METHODS, method))
+        dialect = engine.dialect.name
+        if method == 'auto':
+            method = 'multirow' if dialect == 'mysql' else 'executemany'
+        if method == 'infile' and dialect != 'mysql':
+            raise ValueError('LOAD DATA LOCAL INFILE is only supported by mysql, not %s' % dialect)
+        columns, rows = self.__rows(data, columns, batchSize)
+        if not columns:
+            return LoadReport(tableName, method, 0, 0.0)
+        quote = engine.dialect.identifier_preparer.quote
+        table = '.'.join(quote(part) for part in tableName.split('.'))
+        columnList = ', '.join(quote(col) for col in columns)
+        target = '%s (%s)' % (table, columnList)
+        names = ['p%d' % i for i in range(len(columns))]
+        if method == 'multirow' and dialect in self.MAX_PARAMS:
+            batchSize = max(min(batchSize, self.MAX_PARAMS[dialect] // len(columns)), 1)
+
+        count = 0
+        start = time.perf_counter()
+        with self.connect(engine) as connection:
+            with self.begin_trans(connection):
+                if method == 'infile':
+                    fd, path = tempfile.mkstemp(suffix='.csv')
+                    try:
+                        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as fp:
+                            for row in rows:
+                                fp.write(','.join(self.__csv_value(value) for value in row) + '\n')
+                                count += 1
+                        connection.execute(text(
+                            "LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8mb4 "
+                            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+                            "LINES TERMINATED BY '\\n' (%s)"
+                            % (path.replace('\\', '/'), table, columnList)))
+                    finally:
+                        os.remove(path)
+                else:
+                    single = text('INSERT INTO %s VALUES (%s)' % (target, ', '.join(':' + n for n in names)))
+                    statements = {}
+                    while True:
+                        batch = list(itertools.islice(rows, batchSize))
+                        if not batch:
+                            break
+                        if method == 'executemany':
+                            connection.execute(single, [dict(zip(names, row)) for row in batch])
+                        else:
+                            if len(batch) not in statements:
+                                statements[len(batch)] = text('INSERT INTO %s VALUES %s' % (target, ', '.join(
+                                    '(%s)' % ', '.join(':%s_%d' % (n, r) for n in names)
+                                    for r in range(len(batch)))))
+                            params = {}
+                            for r, row in enumerate(batch):
+                                params.update(('%s_%d' % (n, r), value) for n, value in zip(names, row))
+                            connection.execute(statements[len(batch)], params)
+                        count += len(batch)
+        self.invalidate_cache(tableName)
+        return LoadReport(tableName, method, count, time.perf_counter() - start)
+
+    def enable_query_cache(self, ttl=300, maxEntries=256, maxBytes=64 * 2 ** 20):
+        """
+        Turn on the result cache used by cached_query
+        @param ttl: default seconds to keep a result
+        @param maxEntries: max number of cached results
+        @param maxBytes: max memory of cached results
+        @return: <QueryCache>
+        """
+        self.queryCache = QueryCache(ttl, maxEntries, maxBytes)
+        return self.queryCache
+
+    def cached_query(self, engine: Engine, sql, params=None, ttl=None):
+        """
+        Run a read-only query, returning a copy of the cached result if the same query ran before
+        Query runs every time if the cache is not enabled
+        @param engine: <Engine>db engine
+        @param sql: query text
+        @param params: bound parameters
+        @param ttl: seconds to keep this result (cache ttl if none)
+        @return: <Table>
+        """
+        key = None
+        if self.queryCache is not None:
+            key = QueryCache.key(engine, sql, params)
+            table = self.queryCache.get(key)
+            if table is not None:
+                return table
+        with self.connect(engine) as connection:
+            table = Table(connection.execute(text(str(sql)), params or {}))
+        if key is not None:
+            self.queryCache.put(key, sql, table, ttl)
+        return table
+
+    def invalidate_cache(self, tableName=None):
+        """
+        Drop cached query results depending on a table, call it after a test writes into the table
+        @param tableName: table name (all results if none)
+        @return: number of dropped results
+        """
+        return 0 if self.queryCache is None else self.queryCache.invalidate(tableName)
+
     @contextmanager
-    def dbapi_connect(self, engine: Engine):
+    def dbapi_connect(self, engine: Engine, cursorClass=None):
         """
         Perform a connection using dbapi driver (support call proc & multi table results)
         Can use by "with" block which yield connection, cursor with safe closing
         @param engine: <Engine>db engine
+        @param cursorClass: dbapi cursor class, ex: pymysql.cursors.SSCursor to stream with Table.iter_cursor
         """
+        start = time.perf_counter()
         connection = engine.raw_connection()
-        cursor = connection.cursor()
+        self.__record_wait(engine, time.perf_counter() - start)
+        cursor = connection.cursor() if cursorClass is None else connection.cursor(cursorClass)
         try:
             yield connection, cursor
         except SQLAlchemyError as e:
@@ -200,9 +757,19 @@ class DataFactory(BaseFactory):
         """
         Perform a connection using sqlalchemy connection pool (support sqlalchemy execution methods)
         Can use by "with" block which yield connection and safe closing
+        Inside isolated_session of the engine, the shared session connection is yielded (and kept open).
+        It is only available to the thread which started the session, a connection can not be shared by threads
         @param engine: <Engine>db engine
         """
+        if self.__isolated and engine in self.__isolated:
+            connection, owner = self.__isolated[engine]
+            if owner != threading.get_ident():
+                raise ValueError('%s is in an isolated session of another thread' % engine)
+            yield connection
+            return
+        start = time.perf_counter()
         connection = engine.connect()
+        self.__record_wait(engine, time.perf_counter() - start)
         try:
             yield connection
         except SQLAlchemyError as e:
@@ -211,18 +778,141 @@ class DataFactory(BaseFactory):
             connection.close()
 
     @contextmanager
-    def begin_trans(self, connection):
+    def begin_trans(self, connection, savepoint=False, rollback=False):
         """
         Perform a safe transaction insert/update into database through a connection
-        Rollback if found database exception
+        Commit at the end of "with" block, rollback and re-raise if an exception is raised
+        A savepoint is used on the connection of an isolated session, so its outer transaction is never committed.
+        A savepoint is also used inside a transaction opened by the caller ("with connection.begin():"),
+        which keeps the control of its commit/rollback. An autobegun transaction (sqlalchemy 1.4+) is the one committed
         @param connection: connection to start transaction
+        @param savepoint: start a SAVEPOINT (nested transaction) instead of a transaction
+        @param rollback: always rollback at the end of "with" block
         """
+        if savepoint or self.__is_isolated(connection) or self.__is_caller_transaction(connection):
+            transaction = connection.begin_nested()
+        elif connection.in_transaction() and hasattr(connection, 'get_transaction'):
+            transaction = connection.get_transaction()
+        else:
+            transaction = connection.begin()
+        try:
+            yield transaction
+        except Exception:
+            if transaction.is_active:
+                transaction.rollback()
+            raise
+        if transaction.is_active:
+            if rollback:
+                transaction.rollback()
+            else:
+                transaction.commit()
+
+    @contextmanager
+    def isolated_session(self, engine: Engine):
+        """
+        Start the per-test isolation mode of an engine: one connection and one outer transaction for the session,
+        rolled back at the end. Meanwhile connect(engine) yields this connection, use isolated_test for each test
+        Ex (conftest):
+            @pytest.fixture(scope='session')
+            def db_session():
+                with factory.isolated_session(engine) as connection:
+                    yield connection
+
+            @pytest.fixture(autouse=True)
+            def db_test(db_session):
+                with factory.isolated_test(engine):
+                    yield
+        @param engine: <Engine>db engine
+        """
+        if self.__isolated is None:
+            self.__isolated = {}
+        if engine in self.__isolated:
+            raise ValueError('%s is already in an isolated session' % engine)
+        connection = engine.connect()
         transaction = connection.begin()
+        self.__isolated[engine] = (connection, threading.get_ident())
+        try:
+            yield connection
+        finally:
+            del self.__isolated[engine]
+            try:
+                transaction.rollback()
+            finally:
+                connection.close()
+
+    @contextmanager
+    def isolated_test(self, engine: Engine):
+        """
+        Run a test inside a SAVEPOINT of the isolated session, always rolled back at the end,
+        so every test starts from the data state of the session without re-seeding
+        @param engine: <Engine>db engine in isolated_session
+        """
+        if not self.__isolated or engine not in self.__isolated:
+            raise LookupError('%s is not in an isolated session' % engine)
+        connection = self.__isolated[engine][0]
+        with self.begin_trans(connection, savepoint=True, rollback=True):
+            yield connection
+
+    @asynccontextmanager
+    async def async_connect(self, engine):
+        """
+        Perform an asyncio connection from an async engine (see buildAsyncEngine)
+        Can use by "async with" block which yield connection and safe closing, so db polling can run
+        in the same event loop as other coroutines (ex: Loop.async_wait_any)
+        @param engine: <AsyncEngine>db engine
+        """
+        start = time.perf_counter()
+        connection = await engine.connect()
+        self.__record_wait(engine, time.perf_counter() - start)
+        try:
+            yield connection
+        finally:
+            await connection.close()
+
+    @asynccontextmanager
+    async def async_begin_trans(self, connection, savepoint=False, rollback=False):
+        """
+        Asyncio version of begin_trans: commit at the end of "async with" block, rollback and re-raise on error
+        A savepoint is used inside a transaction opened by the caller ("async with connection.begin():"),
+        an autobegun transaction is the one committed
+        @param connection: <AsyncConnection> to start transaction
+        @param savepoint: start a SAVEPOINT (nested transaction) instead of a transaction
+        @param rollback: always rollback at the end of "async with" block
+        """
+        if savepoint or self.__is_caller_transaction(connection):
+            transaction = await connection.begin_nested().start()
+        elif connection.in_transaction():
+            transaction = connection.get_transaction()
+        else:
+            transaction = await connection.begin().start()
         try:
             yield transaction
-        except SQLAlchemyError as e:
-            print('Caught SQLAlchemyError and rolledback transaction: {}'.format(e))
-            transaction.rollback()
+        except Exception:
+            if transaction.is_active:
+                await transaction.rollback()
+            raise
+        if transaction.is_active:
+            if rollback:
+                await transaction.rollback()
+            else:
+                await transaction.commit()
+
+    async def async_stream(self, engine, sql, params=None, chunksize=Table.CHUNK_SIZE):
+        """
+        Run a query on an async engine and generate its result by tables of at most chunksize rows
+        Rows are streamed from a server side cursor, the whole result is never loaded at once
+        Use: async for table in factory.async_stream(engine, sql): ...
+        @param engine: <AsyncEngine>db engine
+        @param sql: query text
+        @param params: bound parameters
+        @param chunksize: number of rows per table
+        @return: async generator of <Table>
+        """
+        async with self.async_connect(engine) as connection:
+            result = await connection.stream(text(str(sql)), params or {})
+            columns = list(result.keys())
+            async for rows in result.partitions(chunksize):
+                yield Table([tuple(row) for row in rows], columns=columns)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
+import copy
 import time
+from concurrent.futures import ThreadPoolExecutor
 from core.abstract.BaseFactory import BaseFactory
-from core.libs.WebDriver import WebDriver
+from core.libs.WebDriver import WebDriver, WebDriverPool
 
 
 class Page(object):
@@ -77,6 +79,24 @@ class Environment(object):
     domain = property(__getDomain)
 
 
+class RunResult(object):
+    """
+    Object inherited class defines the result of a scenario run on one (engine, environment) combination
+    """
+    value = None
+    error = None
+    elapsed = None
+
+    def __init__(self, engine, environment):
+        self.engine = engine
+        self.environment = environment
+
+    def succeeded(self):
+        return self.error is None
+
+    succeeded = property(succeeded)
+
+
 class PageFactory(BaseFactory):
     """
     Object inherited class defines a POM structure simulate a web system to test
@@ -87,11 +107,31 @@ class PageFactory(BaseFactory):
     """
     __environment = None
     __engine = None
+    __lazyPages = None
 
     # ------ Private methods -------
     def __init__(self, siteName: str):
         self.siteName = siteName
 
+    def __getattr__(self, name):
+        # Only called when the attribute is not found: build a registered page on first access
+        lazyPages = self.__dict__.get('_PageFactory__lazyPages')
+        if lazyPages and name in lazyPages:
+            return self.__materialize(name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+    def __materialize(self, pageName):
+        if self.environment is None:
+            raise ValueError('Please set environment before using page %s' % pageName)
+        if self.engine is None:
+            raise ValueError('Please set engine before using page %s' % pageName)
+        classType, kwargs = self.__lazyPages[pageName]
+        newPage = classType(**dict(kwargs, driver=self.__engine))
+        newPage.domain = self.environment.domain
+        self.storeObj(pageName, newPage, classType)
+        del self.__lazyPages[pageName]
+        return newPage
+
     def __getEnvironment(self):
         return self.__environment
 
@@ -115,12 +155,12 @@ class PageFactory(BaseFactory):
     def switchEnv(self, envObj: Environment):
         """
         Switch the current attached environment into a new stored one
-        Also update domain of all belonged pages
+        Also update domain of all built pages (registered pages not built yet will use it when built)
         @param envObj: environment object to switch
         @return: self
         """
-        if envObj not in self.storedEnvironments:
-            raise LookupError('Environment object is not stored first' % envObj)
+        if not isinstance(envObj, Environment) or self.nameOf(envObj) is None:
+            raise LookupError('Environment object %s is not stored first' % envObj)
         self.environment = envObj
         for page in self.storedPages:
             page.domain = envObj.domain
@@ -129,12 +169,12 @@ class PageFactory(BaseFactory):
     def switchEngine(self, engineObj: WebDriver):
         """
         Switch the current attached WedDriver engine into a new stored one
-        Also update driver of all belonged pages
+        Also update driver of all built pages (registered pages not built yet will use it when built)
         @param engineObj: WebDriver object to switch
         @return: self
         """
-        if engineObj not in self.storedEngines:
-            raise LookupError('Environment object is not stored first' % engineObj)
+        if not isinstance(engineObj, WebDriver) or self.nameOf(engineObj) is None:
+            raise LookupError('WebDriver object %s is not stored first' % engineObj)
         self.engine = engineObj
         for page in self.storedPages:
             page.driver = engineObj
@@ -178,14 +218,96 @@ class PageFactory(BaseFactory):
         if self.engine is None:
             raise ValueError('Please set engine before adding new page')
 
-        kwargs.update({'driver': self.__engine})
-        newPage = classType(**kwargs)
+        newPage = classType(**dict(kwargs, driver=self.__engine))
         if not isinstance(newPage, Page):
             raise ValueError('%s must be %s classtype' % (classType, Page))
         newPage.domain = self.environment.domain
         self.storeObj(pageName, newPage, classType)
         return newPage
 
+    def registerPage(self, pageName: str, classType: Page, kwargs=None):
+        """
+        Register a page to produce lazily: the page object is built on first access (factory.pageName)
+        with the engine & environment attached at that time, so pages never used cost nothing
+        @param pageName: name of the page
+        @param classType: inherited Page classname
+        @param kwargs: more inherited class init kwargs
+        @return: self
+        """
+        if not isinstance(classType, type) or not issubclass(classType, Page):
+            raise ValueError('%s must be %s classtype' % (classType, Page))
+        if pageName in self.__dict__ or hasattr(self.__class__, pageName):
+            raise ValueError('%s is already used in factory' % pageName)
+        if self.__lazyPages is None:
+            self.__lazyPages = {}
+        self.__lazyPages[pageName] = (classType, dict(kwargs or {}))
+        return self
+
+    def pendingPages(self):
+        """
+        Return names of registered pages not built yet
+        @return: <List>str
+        """
+        return list(self.__lazyPages or ())
+
+    pendingPages = property(pendingPages)
+
+    def fork(self, engine: WebDriver = None, environment: Environment = None):
+        """
+        Return a lightweight view of this factory bound to its own engine & environment
+        Built pages are shallow copied (locators and other attributes are shared) and rebound,
+        registered pages not built yet stay lazy in the view. Switching in the view does not affect this factory
+        @param engine: <WebDriver> of the view (current engine if none)
+        @param environment: <Environment> of the view (current environment if none)
+        @return: <PageFactory> view
+        """
+        view = copy.copy(self)
+        view.__lazyPages = dict(self.__lazyPages or {})
+        if engine is not None:
+            view.engine = engine
+        if environment is not None:
+            view.environment = environment
+        for page in self.storedPages:
+            clone = copy.copy(page)
+            clone.driver = view.engine
+            clone.domain = view.environment.domain
+            view.storeObj(self.nameOf(page), clone, Page)
+        return view
+
+    def run_parallel(self, scenario, combinations, maxWorkers=None):
+        """
+        Run a scenario concurrently on many (engine, environment) combinations, each on its own forked view
+        @param scenario: function taking the forked <PageFactory> view, its return value is kept in result
+        @param combinations: list of (engine, environment), engine can be a <WebDriverPool>
+                             to checkout a session for the run and return it afterwards
+        @param maxWorkers: max number of concurrent runs (one per combination if none)
+        @return: <List>RunResult in order of combinations
+        """
+        combinations = list(combinations)
+        if not combinations:
+            return []
+
+        def run(engine, environment):
+            result = RunResult(engine, environment)
+            session = None
+            start = time.perf_counter()
+            try:
+                # A failed checkout is the error of this combination only
+                session = engine.checkout() if isinstance(engine, WebDriverPool) else engine
+                start = time.perf_counter()
+                result.value = scenario(self.fork(session, environment))
+            except Exception as e:
+                result.error = e
+            finally:
+                result.elapsed = time.perf_counter() - start
+                if session is not None and session is not engine:
+                    engine.checkin(session)
+            return result
+
+        with ThreadPoolExecutor(max_workers=maxWorkers or len(combinations)) as executor:
+            futures = [executor.submit(run, engine, environment) for engine, environment in combinations]
+        return [future.result() for future in futures]
+
     def storeEnvironment(self, envName: str, envObj: Environment):
         """
         Store a test environment
@@ -198,8 +320,12 @@ class PageFactory(BaseFactory):
     def storeEngine(self, engineName: str, engineObj: WebDriver):
         """
         Store a WedDriver engine
+        If a WebDriverPool is given, a session is checked out from the pool and stored instead
+        (the session goes back to the pool when quit)
         @param engineName: name to store
-        @param engineObj: <WebDriver> object to store
+        @param engineObj: <WebDriver> or <WebDriverPool> object to store
         @return: self
         """
+        if isinstance(engineObj, WebDriverPool):
+            engineObj = engineObj.checkout()
         return self.storeObj(engineName, engineObj, WebDriver)
@@ -0,0 +1,196 @@
+import math
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections import namedtuple
+from core.libs.Timer import Timer
+
+Comparison = namedtuple('Comparison', ['checkpoint', 'baseline', 'current', 'change', 'pvalue', 'budget', 'regressed'])
+Comparison.__doc__ = """
+    Result of comparing checkpoint durations against their baseline
+    checkpoint: checkpoint name
+    baseline: median of the baseline history (seconds), None if history is too short
+    current: median of the current durations (seconds)
+    change: relative change of the medians (0.3 means 30% slower)
+    pvalue: one-sided Mann-Whitney p-value of current being slower, None if too few samples
+    budget: allowed relative slowdown
+    regressed: True if the slowdown is over budget and significant
+"""
+
+
+class BaselineStore(object):
+    """
+    Local store (sqlite) of checkpoint durations keyed by test, checkpoint and environment
+    Keeps a rolling history of the last samples and compares new durations against it
+    @author: Lex.Khuat
+    """
+    HISTORY = 50
+    MIN_HISTORY = 5
+    MIN_SAMPLES = 3
+    BUDGET = 0.2
+    ALPHA = 0.05
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS durations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test TEXT NOT NULL,
+            checkpoint TEXT NOT NULL,
+            environment TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS durations_key ON durations (test, checkpoint, environment, id);
+    """
+
+    # Private #
+    def __init__(self, path, history=HISTORY):
+        """
+        @param path: sqlite file path (':memory:' for a temporary store)
+        @param history: number of samples kept per test/checkpoint/environment
+        """
+        if path != ':memory:':
+            path = os.path.realpath(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.history = history
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def mann_whitney(baseline, current):
+        """
+        One-sided Mann-Whitney U test (normal approximation with tie correction)
+        @param baseline: list of durations
+        @param current: list of durations
+        @return: p-value of current durations being greater than baseline ones
+        """
+        n1, n2 = len(current), len(baseline)
+        ranked = sorted([(value, 0) for value in current] + [(value, 1) for value in baseline])
+        ranks = [0.0] * len(ranked)
+        ties = 0.0
+        i = 0
+        while i < len(ranked):
+            j = i
+            while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+                j += 1
+            for k in range(i, j + 1):
+                ranks[k] = (i + j) / 2.0 + 1
+            count = j - i + 1
+            ties += count ** 3 - count
+            i = j + 1
+        u = sum(rank for rank, (value, group) in zip(ranks, ranked) if group == 0) - n1 * (n1 + 1) / 2.0
+        n = n1 + n2
+        variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+        if variance <= 0:
+            return 1.0
+        z = (u - n1 * n2 / 2.0 - 0.5) / math.sqrt(variance)
+        return 0.5 * math.erfc(z / math.sqrt(2))
+
+    # Store
+    def record(self, test, environment, samples):
+        """
+        Add durations to the history, only the last samples are kept
+        @param test: test id
+        @param environment: environment name
+        @param samples: dict of checkpoint: <List>seconds (see Timer.samples)
+        @return: self
+        """
+        now = time.time()
+        with self.__lock, self.__conn:
+            for checkpoint, values in samples.items():
+                self.__conn.executemany(
+                    'INSERT INTO durations (test, checkpoint, environment, seconds, created) VALUES (?, ?, ?, ?, ?)',
+                    [(test, str(checkpoint), environment, float(value), now) for value in values])
+                self.__conn.execute(
+                    'DELETE FROM durations WHERE test = ? AND checkpoint = ? AND environment = ? AND id NOT IN '
+                    '(SELECT id FROM durations WHERE test = ? AND checkpoint = ? AND environment = ? '
+                    'ORDER BY id DESC LIMIT ?)',
+                    (test, str(checkpoint), environment) * 2 + (self.history,))
+        return self
+
+    def samples(self, test, checkpoint, environment):
+        """
+        Return the baseline history of a checkpoint
+        @param test: test id
+        @param checkpoint: checkpoint name
+        @param environment: environment name
+        @return: <List>seconds, oldest first
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT seconds FROM durations WHERE test = ? AND checkpoint = ? AND environment = ? ORDER BY id',
+                (test, str(checkpoint), environment)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self, test=None, environment=None):
+        """
+        Remove the history of a test/environment (everything if none)
+        @return: self
+        """
+        clauses = [(column, value) for column, value in (('test', test), ('environment', environment))
+                   if value is not None]
+        where = ' AND '.join('%s = ?' % column for column, value in clauses)
+        with self.__lock, self.__conn:
+            self.__conn.execute('DELETE FROM durations' + (' WHERE ' + where if where else ''),
+                                [value for column, value in clauses])
+        return self
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+    # Compare
+    def compare(self, test, environment, samples, budgets=None, alpha=ALPHA):
+        """
+        Compare current durations of each checkpoint against the baseline
+        A checkpoint regresses when its median is slower than the baseline median by more than its budget, and
+        the slowdown is significant: Mann-Whitney p-value < alpha when there are enough current samples,
+        otherwise the current median must also be over the 95th percentile of the baseline
+        @param test: test id
+        @param environment: environment name
+        @param samples: dict of checkpoint: <List>seconds (see Timer.samples)
+        @param budgets: dict of checkpoint: allowed relative slowdown, '*' for other checkpoints (BUDGET if none)
+        @param alpha: significance level
+        @return: <List>Comparison
+        """
+        budgets = budgets or {}
+        result = []
+        for checkpoint, values in samples.items():
+            budget = budgets.get(checkpoint, budgets.get('*', self.BUDGET))
+            current = statistics.median(values)
+            history = self.samples(test, checkpoint, environment)
+            if len(history) < self.MIN_HISTORY:
+                result.append(Comparison(checkpoint, None, current, None, None, budget, False))
+                continue
+            baseline = statistics.median(history)
+            change = current / baseline - 1 if baseline else 0.0
+            if len(values) >= self.MIN_SAMPLES:
+                pvalue = self.mann_whitney(history, values)
+                significant = pvalue < alpha
+            else:
+                pvalue = None
+                significant = current > Timer.percentile(sorted(history), 95)
+            result.append(Comparison(checkpoint, baseline, current, change, pvalue, budget,
+                                     change > budget and significant))
+        return result
+
+    @staticmethod
+    def report(comparisons):
+        """
+        Format comparisons as readable lines
+        @param comparisons: <List>Comparison
+        @return: string
+        """
+        lines = []
+        for item in comparisons:
+            if item.baseline is None:
+                lines.append('%s: %.3fs (no baseline yet)' % (item.checkpoint, item.current))
+                continue
+            lines.append('%s: %.3fs vs baseline %.3fs (%+.1f%%, budget %.0f%%%s)%s'
+                         % (item.checkpoint, item.current, item.baseline, item.change * 100, item.budget * 100,
+                            '' if item.pvalue is None else ', p=%.3f' % item.pvalue,
+                            ' REGRESSED' if item.regressed else ''))
+        return '\n'.join(lines)
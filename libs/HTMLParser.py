@@ -1,15 +1,218 @@
+import codecs
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 from core.models.Table import Table
 
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = lxml_html = None
+
 
 class HtmlParser(object):
     """
     Class to support parse html content
+    Backends:
+    - html.parser: BeautifulSoup tree using python html.parser (default)
+    - lxml: lxml.html tree, much faster on large pages
+    - iterparse: lxml iterparse over the source, parse_table streams rows without building the whole tree
     """
+    BACKENDS = ('html.parser', 'lxml', 'iterparse')
+    BOMS = ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16le'), (codecs.BOM_UTF16_BE, 'utf-16be'))
+    META_CHARSET = re.compile(br'''<meta[^>]+charset\s*=\s*["']?\s*([\w:.-]+)''', re.IGNORECASE)
+    CHUNK_SIZE = 1 << 20
+    CACHE_SIZE = 16
+    __cache__ = OrderedDict()
 
     # ----------------- Private methods -------------------
-    def __init__(self):
+    def __init__(self, backend='html.parser'):
+        if backend not in self.BACKENDS:
+            raise ValueError('Backend must be one of %s: %s' % (self.BACKENDS, backend))
+        if backend != 'html.parser' and etree is None:
+            raise ImportError('lxml package is required for %s backend' % backend)
         self.__raw__ = None
+        self.__backend__ = backend
+        self.__source__ = None
+        self.__encoding__ = None
+
+    def __tree__(self):
+        if self.__raw__ is None:
+            self.__raw__ = lxml_html.parse(
+                self.__open__(), parser=lxml_html.HTMLParser(encoding=self.__encoding__)).getroot()
+        return self.__raw__
+
+    def __open__(self):
+        if isinstance(self.__source__, bytes):
+            return io.BytesIO(self.__source__)
+        return self.__source__
+
+    @staticmethod
+    def __text__(elem):
+        return ''.join(elem.itertext())
+
+    @staticmethod
+    def __span__(value):
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return 1
+
+    def __cell__(self, cell):
+        if self.__backend__ == 'html.parser':
+            return cell.name == 'th', cell.get_text(), self.__span__(cell.get('colspan')), \
+                self.__span__(cell.get('rowspan'))
+        return cell.tag == 'th', self.__text__(cell), self.__span__(cell.get('colspan')), \
+            self.__span__(cell.get('rowspan'))
+
+    def __find_table__(self, index, id, selector):
+        """
+        Select the table element in the parsed tree: by css selector, id or index (first table by default)
+        The whole document is used when there is no table element and no selection
+        """
+        if self.__backend__ == 'html.parser':
+            if selector is not None:
+                return self.__raw__.select_one(selector)
+            if id is not None:
+                return self.__raw__.find('table', id=id)
+            tables = self.__raw__.find_all('table')
+        else:
+            if selector is not None:
+                found = self.__tree__().cssselect(selector)
+                return found[0] if found else None
+            if id is not None:
+                found = self.__tree__().xpath('//table[@id=$id]', id=id)
+                return found[0] if found else None
+            tables = self.__tree__().xpath('//table')
+        if index is None:
+            return tables[0] if tables else self.__tree__()
+        return tables[index] if -len(tables) <= index < len(tables) else None
+
+    def __iter_rows__(self, table):
+        """
+        Generate rows of (is_header, text, colspan, rowspan) cells belonging to the table (not nested tables)
+        """
+        if self.__backend__ == 'html.parser':
+            for row in table.find_all('tr'):
+                if table.name == 'table' and row.find_parent('table') is not table:
+                    continue
+                yield [self.__cell__(cell) for cell in row.find_all(['td', 'th'], recursive=False)]
+        else:
+            rows = table.xpath('./tr | ./thead/tr | ./tbody/tr | ./tfoot/tr') if table.tag == 'table' \
+                else table.iter('tr')
+            for row in rows:
+                yield [self.__cell__(cell) for cell in row.xpath('./td | ./th')]
+
+    def __stream_rows__(self, index, id):
+        """
+        Stream rows of the selected table from the source with iterparse,
+        rows are cleared once read and parsing stops at the end of the table
+        """
+        target = None
+        stack = []
+        loose = []
+        count = 0
+        for event, elem in etree.iterparse(self.__open__(), events=('start', 'end'), tag=('table', 'tr'),
+                                           html=True, encoding=self.__encoding__):
+            if elem.tag == 'table':
+                if event == 'start':
+                    if target is None and (elem.get('id') == id if id is not None else count == (index or 0)):
+                        target = elem
+                    stack.append(elem)
+                    count += 1
+                    continue
+                stack.pop()
+                if elem is target:
+                    return
+                continue
+            if event == 'start':
+                continue
+            if stack and stack[-1] is target:
+                yield [self.__cell__(cell) for cell in elem if cell.tag in ('td', 'th')]
+            elif target is None and not stack and index is None and id is None:
+                loose.append([self.__cell__(cell) for cell in elem if cell.tag in ('td', 'th')])
+            elif target is not None and target in stack:
+                # Row of a table nested in the selected one, its text is read with the outer cell
+                continue
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        if target is None and index is None and id is None:
+            for row in loose:
+                yield row
+        elif target is None:
+            raise LookupError('Table not found: %s' % (id if id is not None else index))
+
+    @staticmethod
+    def __build__(rows, strip):
+        """
+        Expand colspan/rowspan into a rectangular grid
+        Leading rows of only th cells are used as header, multi-row headers are joined by a space,
+        repeated labels get a .1, .2 suffix
+        @return: <Table>
+        """
+        header = []
+        data = []
+        spans = {}
+        for cells in rows:
+            line = []
+            col = 0
+            cells = iter(cells)
+            cell = next(cells, None)
+            while cell is not None or any(c >= col for c in spans):
+                if col in spans:
+                    remaining, th, text = spans.pop(col)
+                    if remaining > 1:
+                        spans[col] = (remaining - 1, th, text)
+                    line.append((th, text))
+                    col += 1
+                    continue
+                if cell is None:
+                    line.append((False, None))
+                    col += 1
+                    continue
+                th, text, colspan, rowspan = cell
+                if strip:
+                    text = text.strip()
+                for _ in range(colspan):
+                    if rowspan > 1:
+                        spans[col] = (rowspan - 1, th, text)
+                    line.append((th, text))
+                    col += 1
+                cell = next(cells, None)
+            if not line:
+                continue
+            if not data and all(th for th, text in line):
+                header.append([text for th, text in line])
+            else:
+                data.append([text for th, text in line])
+
+        width = max([len(line) for line in header + data] or [0])
+        columns = []
+        for col in range(width):
+            names = []
+            for line in header:
+                if col < len(line) and line[col] and line[col] not in names:
+                    names.append(line[col])
+            name = ' '.join(names) if names else str(col)
+            # Header cells expanded by colspan repeat their label, made unique as pandas does (b, b.1, b.2)
+            label, count = name, 0
+            while label in columns:
+                count += 1
+                label = '%s.%d' % (name, count)
+            columns.append(label)
+        for line in data:
+            line.extend([None] * (width - len(line)))
+        return Table(data, columns=columns)
 
     # ----------------- Public methods -------------------
     def get_childs(self, tagname):
@@ -18,46 +221,192 @@ class HtmlParser(object):
         @param tagname: tagname to get
         @return: list of childs
         """
-        return self.__raw__.findAll(tagname)
+        if self.__backend__ == 'html.parser':
+            return self.__raw__.findAll(tagname)
+        return list(self.__tree__().iter(tagname))
 
-    def parse_table(self):
+    def parse_table(self, index=None, id=None, selector=None, dtypes=None, strip=False):
         """
         Parse a table from htmlparser object
-        @return: a list dict virtualize the parsed table
+        colspan/rowspan are expanded into a rectangular grid, leading th rows are used as header
+        @param index: index of the table in the document (first table if no selection)
+        @param id: id of the table
+        @param selector: css selector of the table (not supported by iterparse backend)
+        @param dtypes: None to keep text, 'infer' to detect numeric/datetime columns,
+                       or dict of column: dtype (see Table.convert_types)
+        @param strip: strip whitespaces around cell text
+        @return: <Table>
         """
-        # Parse header
-        tmp_header = []
-        for elem in self.__raw__.findAll('th'):
-            tmp_header.append(''.join([str(s) for s in elem.findAll(text=True)]))
+        if self.__backend__ == 'iterparse' and self.__raw__ is None:
+            if selector is not None:
+                raise ValueError('Css selector is not supported by iterparse backend, use index or id')
+            rows = self.__stream_rows__(index, id)
+        else:
+            table = self.__find_table__(index, id, selector)
+            if table is None:
+                raise LookupError('Table not found: %s' % next(
+                    str(v) for v in (selector, id, index) if v is not None))
+            rows = self.__iter_rows__(table)
+        table = self.__build__(rows, strip)
+        if dtypes is not None:
+            table.convert_types(dtypes)
+        return table
 
-        # Parse content
-        tmp_table = []
-        for row in self.__raw__.findAll('tr'):
-            tmp_row = []
-            for cell in row.findAll('td'):
-                tmp_cell_val = ''.join([str(s) for s in cell.findAll(text=True)])
-                tmp_row.append(tmp_cell_val)
-            if tmp_row:
-                tmp_table.append(tmp_row)
-        return Table(tmp_table, columns=tmp_header)
+    @staticmethod
+    def sniff_encoding(data):
+        """
+        Detect encoding of html bytes from byte order mark or meta charset declaration
+        @param data: first bytes of the html content
+        @return: encoding name, None if unknown
+        """
+        for bom, encoding in HtmlParser.BOMS:
+            if data.startswith(bom):
+                return encoding
+        found = HtmlParser.META_CHARSET.search(data)
+        if found:
+            encoding = found.group(1).decode('ascii')
+            try:
+                codecs.lookup(encoding)
+                return encoding
+            except LookupError:
+                pass
+        return None
 
     @staticmethod
-    def get_html_file_content(filepath):
+    def clear_cache():
+        """
+        Drop all parsed files kept by get_html_file_content
+        """
+        HtmlParser.__cache__.clear()
+
+    @staticmethod
+    def get_html_file_content(filepath, backend='html.parser', cache=True):
         """
         Return a htmlParser object which holds html content from a html or text file
+        The file is memory-mapped and its bytes go to the parser with the encoding sniffed from BOM/meta.
+        Parsed files are cached by path, modified time and size, so unchanged files are not parsed again
         @param filepath: path to html file
+        @param backend: html.parser, lxml or iterparse (file is only read when parsing)
+        @param cache: reuse/keep the parsed content in cache
         @return: self
         """
-        with open(filepath) as fp:
-            return HtmlParser.get_html_content(fp)
+        path = os.path.realpath(filepath)
+        stat = os.stat(path)
+        key = (path, backend)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if cache and key in HtmlParser.__cache__:
+            cached_version, cached_parser = HtmlParser.__cache__[key]
+            if cached_version == version:
+                HtmlParser.__cache__.move_to_end(key)
+                return cached_parser
+
+        new_iParser = HtmlParser(backend)
+        with open(path, 'rb') as fp:
+            if backend == 'iterparse':
+                new_iParser.__source__ = path
+                new_iParser.__encoding__ = HtmlParser.sniff_encoding(fp.read(1024))
+            elif stat.st_size == 0:
+                new_iParser.__raw__ = BeautifulSoup(b'', 'html.parser') if backend == 'html.parser' \
+                    else lxml_html.document_fromstring('<html></html>')
+            else:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    encoding = HtmlParser.sniff_encoding(content[:1024])
+                    new_iParser.__encoding__ = encoding
+                    if backend == 'lxml':
+                        # Feed mapped pages by chunks, the whole file is never copied into one bytes object
+                        parser = lxml_html.HTMLParser(encoding=encoding)
+                        for i in range(0, len(content), HtmlParser.CHUNK_SIZE):
+                            parser.feed(content[i:i + HtmlParser.CHUNK_SIZE])
+                        new_iParser.__raw__ = parser.close()
+                    else:
+                        new_iParser.__raw__ = BeautifulSoup(content[:], 'html.parser', from_encoding=encoding)
+
+        if cache:
+            HtmlParser.__cache__[key] = (version, new_iParser)
+            while len(HtmlParser.__cache__) > HtmlParser.CACHE_SIZE:
+                HtmlParser.__cache__.popitem(last=False)
+        return new_iParser
 
     @staticmethod
-    def get_html_content(text):
+    def get_html_content(text, backend='html.parser'):
         """
         Return a htmlParser object from a block of html text
         @param text: block of html content to format
+        @param backend: html.parser, lxml or iterparse
         @return: self
         """
-        new_iParser = HtmlParser()
-        new_iParser.__raw__ = BeautifulSoup(text, 'html.parser')
+        new_iParser = HtmlParser(backend)
+        if backend == 'html.parser':
+            new_iParser.__raw__ = BeautifulSoup(text, 'html.parser')
+            return new_iParser
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        if backend == 'iterparse':
+            new_iParser.__source__ = text
+        else:
+            new_iParser.__raw__ = lxml_html.document_fromstring(
+                text, parser=lxml_html.HTMLParser(encoding='utf-8'))
         return new_iParser
+
+    @staticmethod
+    def __peak_rss__():
+        """
+        Return the peak resident memory of this process in bytes, None if it can not be measured
+        (tracemalloc would miss memory allocated by libxml2 for lxml trees)
+        """
+        try:
+            import resource
+        except ImportError:
+            try:
+                import psutil
+            except ImportError:
+                return None
+            info = psutil.Process().memory_info()
+            return getattr(info, 'peak_wset', info.rss)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @staticmethod
+    def __measure__(path, backend):
+        # Run in a fresh process, so the peak memory of a backend is not hidden by the peak of another one
+        before = HtmlParser.__peak_rss__()
+        start = time.perf_counter()
+        table = HtmlParser.get_html_file_content(path, backend, cache=False).parse_table()
+        seconds = time.perf_counter() - start
+        after = HtmlParser.__peak_rss__()
+        peak = None if before is None else (after - before) / 2 ** 20
+        return {'seconds': seconds, 'peakMB': peak, 'rows': len(table)}
+
+    @staticmethod
+    def benchmark(rows=50000, cols=10, backends=BACKENDS):
+        """
+        Compare backends parsing a generated html file with one large table
+        Each backend runs in its own process, peakMB is the growth of its peak resident memory (RSS)
+        @param rows: number of table rows
+        @param cols: number of table columns
+        @param backends: backends to compare
+        @return: dict of backend: {'seconds', 'peakMB', 'rows'}, peakMB is None if RSS can not be measured
+        """
+        fd, path = tempfile.mkstemp(suffix='.html')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('<html><body><table><tr>')
+            fp.write(''.join('<th>Col %d</th>' % c for c in range(cols)))
+            fp.write('</tr>')
+            for r in range(rows):
+                fp.write('<tr>%s</tr>' % ''.join('<td><span>%d</span>.%d</td>' % (r, c) for c in range(cols)))
+            fp.write('</table></body></html>')
+        results = {}
+        try:
+            for backend in backends:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    results[backend] = executor.submit(HtmlParser.__measure__, path, backend).result()
+        finally:
+            os.remove(path)
+        return results
+
+
+if __name__ == '__main__':
+    for name, result in HtmlParser.benchmark().items():
+        print('{:<12} {:>8.2f}s {:>10} {:>8} rows'.format(
+            name, result['seconds'], 'n/a' if result['peakMB'] is None else '%.1fMB' % result['peakMB'],
+            result['rows']))
@@ -1,71 +1,284 @@
+import asyncio
+import functools
+import random
 import time
+from collections import namedtuple
+
+PollResult = namedtuple('PollResult', ['success', 'value', 'attempts', 'elapsed'])
+PollResult.__doc__ = """
+    Result of a polling loop
+    success: condition was matched before timeout
+    value: last value returned by the polled function
+    attempts: number of times the function was called
+    elapsed: seconds spent in the loop
+"""
 
 
 class Loop(object):
     """
     Supports methods to loop running function until expected condition is matched
     @author: Lex.Khuat
-    @version: 1.1
+    @version: 1.3
     """
+    MIN_INTERVAL = 0.05
+    BACKOFF = 2.0
+
+    @staticmethod
+    async def __invoke__(wait_func, *args):
+        if asyncio.iscoroutinefunction(wait_func):
+            return await wait_func(*args)
+        # Run blocking functions (driver or db calls) in a worker thread so conditions poll concurrently
+        value = await asyncio.get_running_loop().run_in_executor(None, functools.partial(wait_func, *args))
+        if asyncio.iscoroutine(value):
+            value = await value
+        return value
+
+    @staticmethod
+    def intervals(min_interval, max_interval, backoff=BACKOFF, jitter=False):
+        """
+        Generate sleeping intervals growing exponentially from min_interval up to max_interval
+        @param min_interval: first interval (seconds)
+        @param max_interval: largest interval (seconds)
+        @param backoff: multiplier applied after each cycle (1 for fixed interval)
+        @param jitter: randomize each interval between min_interval and current interval
+        """
+        interval = min(min_interval, max_interval)
+        while True:
+            yield random.uniform(min_interval, interval) if jitter else interval
+            interval = min(interval * backoff, max_interval)
+
+    @staticmethod
+    def poll(timeout, wait_func, *args, predicate=bool, min_interval=MIN_INTERVAL, max_interval=1.0,
+             backoff=BACKOFF, jitter=False):
+        """
+        Loop running the function until predicate of its returned value is True or timeout is reached
+        The function is always called at least once, and once more right at the deadline
+        @param timeout: time to wait (seconds, fractions allowed)
+        @param wait_func: function name to execute
+        @param args: function args
+        @param predicate: function checking the returned value
+        @param min_interval: first interval between cycles (seconds)
+        @param max_interval: largest interval between cycles (seconds)
+        @param backoff: multiplier of the interval after each cycle (1 for fixed interval)
+        @param jitter: randomize intervals to avoid polling in lockstep
+        @return: <PollResult>
+        """
+        start = time.monotonic()
+        deadline = start + float(timeout)
+        intervals = Loop.intervals(min_interval, max_interval, backoff, jitter)
+        attempts = 0
+        while True:
+            value = wait_func(*args)
+            attempts += 1
+            if predicate(value):
+                return PollResult(True, value, attempts, time.monotonic() - start)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return PollResult(False, value, attempts, time.monotonic() - start)
+            time.sleep(min(next(intervals), remaining))
 
     @staticmethod
     def wait_until_true(timeout, frequency, wait_func, *args):
         """
         Loop running the expected expression until True is returned
         @param timeout: time to wait (seconds)
-        @param frequency: interval of seconds each cycle run
+        @param frequency: largest interval of seconds each cycle run
         @param wait_func: function name to execute
         @param args: function args
         """
-        maxtime = time.time() + int(timeout)
-        while not wait_func(*args):
-            if time.time() > maxtime:
-                return False
-            time.sleep(frequency)
+        result = Loop.poll(timeout, wait_func, *args,
+                           min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        if not result.success:
+            return False
 
     @staticmethod
     def wait_until_false(timeout, frequency, wait_func, *args):
         """
         Loop running the expected expression until False is returned
         @param timeout: time to wait (seconds)
-        @param frequency: interval of seconds each cycle run
+        @param frequency: largest interval of seconds each cycle run
         @param wait_func: function name to execute
         @param args: function args
         """
-        maxtime = time.time() + int(timeout)
-        while wait_func(*args):
-            if time.time() > maxtime:
-                return True
-            time.sleep(frequency)
+        result = Loop.poll(timeout, wait_func, *args, predicate=lambda v: not v,
+                           min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        if not result.success:
+            return True
 
     @staticmethod
     def wait_until_equal(timeout, frequency, expectation, wait_func, *args):
         """
         Loop running the expected expression until expectation value is matched
         @param timeout: time to wait (seconds)
-        @param frequency: interval of seconds each cycle run
+        @param frequency: largest interval of seconds each cycle run
         @param expectation: the value to compare
         @param wait_func: function name to execute
         @param args: function args
         """
-        maxtime = time.time() + int(timeout)
-        while wait_func(*args) != expectation:
-            if time.time() > maxtime:
-                return False
-            time.sleep(frequency)
+        result = Loop.poll(timeout, wait_func, *args, predicate=lambda v: v == expectation,
+                           min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        if not result.success:
+            return False
 
     @staticmethod
     def wait_until_not_equal(timeout, frequency, expectation, wait_func, *args):
         """
         Loop running the expected expression until expectation value is not matched
         @param timeout: time to wait (seconds)
-        @param frequency: interval of seconds each cycle run
+        @param frequency: largest interval of seconds each cycle run
         @param expectation: the value to compare
         @param wait_func: function name to execute
         @param args: function args
         """
-        maxtime = time.time() + int(timeout)
-        while wait_func(*args) == expectation:
-            if time.time() > maxtime:
-                return False
-            time.sleep(frequency)
+        result = Loop.poll(timeout, wait_func, *args, predicate=lambda v: v != expectation,
+                           min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        if not result.success:
+            return False
+
+    # ------ Asyncio -------
+    @staticmethod
+    async def async_poll(timeout, wait_func, *args, predicate=bool, min_interval=MIN_INTERVAL, max_interval=1.0,
+                         backoff=BACKOFF, jitter=False):
+        """
+        Coroutine version of poll. wait_func can be a coroutine function or a blocking function,
+        which is then run in the default executor
+        @param timeout: time to wait (seconds, fractions allowed)
+        @param wait_func: function name to execute
+        @param args: function args
+        @param predicate: function checking the returned value
+        @param min_interval: first interval between cycles (seconds)
+        @param max_interval: largest interval between cycles (seconds)
+        @param backoff: multiplier of the interval after each cycle (1 for fixed interval)
+        @param jitter: randomize intervals to avoid polling in lockstep
+        @return: <PollResult>
+        """
+        start = time.monotonic()
+        deadline = start + float(timeout)
+        intervals = Loop.intervals(min_interval, max_interval, backoff, jitter)
+        attempts = 0
+        while True:
+            value = await Loop.__invoke__(wait_func, *args)
+            attempts += 1
+            if predicate(value):
+                return PollResult(True, value, attempts, time.monotonic() - start)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return PollResult(False, value, attempts, time.monotonic() - start)
+            await asyncio.sleep(min(next(intervals), remaining))
+
+    @staticmethod
+    async def async_wait_until_true(timeout, frequency, wait_func, *args):
+        """
+        Coroutine version of wait_until_true
+        @param timeout: time to wait (seconds)
+        @param frequency: largest interval of seconds each cycle run
+        @param wait_func: function name to execute
+        @param args: function args
+        @return: True if matched before timeout
+        """
+        result = await Loop.async_poll(timeout, wait_func, *args,
+                                       min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        return result.success
+
+    @staticmethod
+    async def async_wait_until_false(timeout, frequency, wait_func, *args):
+        """
+        Coroutine version of wait_until_false
+        @param timeout: time to wait (seconds)
+        @param frequency: largest interval of seconds each cycle run
+        @param wait_func: function name to execute
+        @param args: function args
+        @return: True if matched before timeout
+        """
+        result = await Loop.async_poll(timeout, wait_func, *args, predicate=lambda v: not v,
+                                       min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        return result.success
+
+    @staticmethod
+    async def async_wait_until_equal(timeout, frequency, expectation, wait_func, *args):
+        """
+        Coroutine version of wait_until_equal
+        @param timeout: time to wait (seconds)
+        @param frequency: largest interval of seconds each cycle run
+        @param expectation: the value to compare
+        @param wait_func: function name to execute
+        @param args: function args
+        @return: True if matched before timeout
+        """
+        result = await Loop.async_poll(timeout, wait_func, *args, predicate=lambda v: v == expectation,
+                                       min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        return result.success
+
+    @staticmethod
+    async def async_wait_until_not_equal(timeout, frequency, expectation, wait_func, *args):
+        """
+        Coroutine version of wait_until_not_equal
+        @param timeout: time to wait (seconds)
+        @param frequency: largest interval of seconds each cycle run
+        @param expectation: the value to compare
+        @param wait_func: function name to execute
+        @param args: function args
+        @return: True if matched before timeout
+        """
+        result = await Loop.async_poll(timeout, wait_func, *args, predicate=lambda v: v != expectation,
+                                       min_interval=min(Loop.MIN_INTERVAL, frequency), max_interval=frequency)
+        return result.success
+
+    @staticmethod
+    async def __combine__(timeout, conditions, needAll, pollArgs):
+        tasks = [asyncio.ensure_future(Loop.async_poll(timeout, condition, **pollArgs))
+                 for condition in conditions]
+        results = [None] * len(tasks)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[tasks.index(task)] = task.result()
+                if any(r is not None and r.success != needAll for r in results):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return results
+
+    @staticmethod
+    async def async_wait_any(timeout, *conditions, **pollArgs):
+        """
+        Poll several conditions concurrently until any of them is True
+        Other conditions are cancelled as soon as one is matched
+        @param timeout: time to wait (seconds)
+        @param conditions: functions (blocking or coroutine) without args, use lambda/functools.partial to bind args
+        @param pollArgs: more keyword args of async_poll (predicate, min_interval, max_interval, backoff, jitter)
+        @return: <List>PollResult in order of conditions, None for cancelled ones
+        """
+        return await Loop.__combine__(timeout, conditions, False, pollArgs)
+
+    @staticmethod
+    async def async_wait_all(timeout, *conditions, **pollArgs):
+        """
+        Poll several conditions concurrently until all of them are True
+        Stop early when one condition timed out since the combination can not be matched anymore
+        @param timeout: time to wait (seconds)
+        @param conditions: functions (blocking or coroutine) without args, use lambda/functools.partial to bind args
+        @param pollArgs: more keyword args of async_poll (predicate, min_interval, max_interval, backoff, jitter)
+        @return: <List>PollResult in order of conditions, None for cancelled ones
+        """
+        return await Loop.__combine__(timeout, conditions, True, pollArgs)
+
+    @staticmethod
+    def wait_any(timeout, *conditions, **pollArgs):
+        """
+        Blocking version of async_wait_any (must not be called from a running event loop)
+        @return: <List>PollResult in order of conditions, None for cancelled ones
+        """
+        return asyncio.run(Loop.async_wait_any(timeout, *conditions, **pollArgs))
+
+    @staticmethod
+    def wait_all(timeout, *conditions, **pollArgs):
+        """
+        Blocking version of async_wait_all (must not be called from a running event loop)
+        @return: <List>PollResult in order of conditions, None for cancelled ones
+        """
+        return asyncio.run(Loop.async_wait_all(timeout, *conditions, **pollArgs))
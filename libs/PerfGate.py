@@ -0,0 +1,68 @@
+"""
+    Pytest plugin gating performance regressions of BaseUIPerformanceTest against a BaselineStore
+    Enable it with `-p core.libs.PerfGate` or `pytest_plugins = ['core.libs.PerfGate']` in conftest.py
+
+    Every passed test owning a timer (BaseUIPerformanceTest) is compared against its baseline,
+    per checkpoint budgets are read from the test class `perfBudgets` attribute
+    Durations are added to the baseline when the test is not regressed (always with --perf-update)
+"""
+import warnings
+import pytest
+from core.libs.Baseline import BaselineStore
+from core.libs.Timer import Timer
+
+
+class PerformanceWarning(UserWarning):
+    """
+    Warning of a checkpoint slower than its baseline
+    """
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('perfgate', 'performance baseline')
+    group.addoption('--perf-baseline', default='.perf/baseline.sqlite',
+                    help='sqlite file storing checkpoint durations history')
+    group.addoption('--perf-env', default='default',
+                    help='environment name the durations are compared within')
+    group.addoption('--perf-gate', default='fail', choices=('fail', 'warn', 'off'),
+                    help='action on regression beyond budget')
+    group.addoption('--perf-budget', default=BaselineStore.BUDGET, type=float,
+                    help='allowed relative slowdown of checkpoints without their own budget')
+    group.addoption('--perf-update', action='store_true',
+                    help='record durations into the baseline even if they regressed')
+
+
+def pytest_configure(config):
+    if config.getoption('perf_gate') != 'off':
+        config._perfBaseline = BaselineStore(config.getoption('perf_baseline'))
+
+
+def pytest_unconfigure(config):
+    store = getattr(config, '_perfBaseline', None)
+    if store is not None:
+        store.close()
+        del config._perfBaseline
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_runtest_call(item):
+    # Only reached when the test body passed
+    store = getattr(item.config, '_perfBaseline', None)
+    timer = getattr(getattr(item, 'instance', None), 'timer', None)
+    if store is None or not isinstance(timer, Timer):
+        return
+    samples = timer.samples()
+    if not samples:
+        return
+    config = item.config
+    environment = config.getoption('perf_env')
+    budgets = dict({'*': config.getoption('perf_budget')}, **getattr(item.instance, 'perfBudgets', {}))
+    comparisons = store.compare(item.nodeid, environment, samples, budgets)
+    regressed = [comparison for comparison in comparisons if comparison.regressed]
+    if not regressed or config.getoption('perf_update'):
+        store.record(item.nodeid, environment, samples)
+    if regressed:
+        message = 'Performance regression in %s [%s]\n%s' % (item.nodeid, environment, store.report(comparisons))
+        if config.getoption('perf_gate') == 'fail':
+            pytest.fail(message, pytrace=False)
+        warnings.warn(PerformanceWarning(message))
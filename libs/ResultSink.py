@@ -0,0 +1,325 @@
+"""
+    Thread & process safe collection of test results (BaseTest.add_testResult)
+    Results are buffered by column and flushed to a file per worker process (pytest-xdist safe),
+    the worker files are combined by merge() once every worker is done
+
+    Used as a pytest plugin (`-p core.libs.ResultSink`), worker files are flushed at session end
+    and merged by the controller into <results-dir>/results.<format>
+    Without the plugin, the default sink removes its worker file at exit
+"""
+import atexit
+import csv
+import glob
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+
+
+class ResultSink(object):
+    """
+    Columnar buffer of test results periodically appended to a per-worker file (jsonl, csv or parquet)
+    Files also keep the python type name of Actual/Expect values (ActualType, ExpectType columns):
+    None, bool, int, float, str and Decimal values are read back with their type (numpy scalars are stored as
+    their python value), other values are read back as they were written (str for csv/parquet, json value or
+    str for jsonl)
+    @author: Lex.Khuat
+    """
+    COLUMNS = ('Scenario', 'Actual', 'Expect')
+    FIELDS = COLUMNS + ('ActualType', 'ExpectType')
+    TYPES = {'NoneType': lambda value: None,
+             'bool': lambda value: value if isinstance(value, bool) else value == 'True',
+             'int': int,
+             'float': float,
+             'str': str,
+             'Decimal': lambda value: Decimal(str(value))}
+    # numpy scalar type names, for files written before scalars were stored as python values
+    TYPES.update(dict.fromkeys(('int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64'), int))
+    TYPES.update(dict.fromkeys(('float16', 'float32', 'float64', 'longdouble'), float))
+    TYPES.update({'bool_': TYPES['bool'], 'str_': str})
+    FORMATS = ('jsonl', 'csv', 'parquet')
+    PREFIX = 'results'
+    dirpath = '.results'
+    format = 'jsonl'
+    flushSize = 10000
+    flushInterval = 30.0
+    keepFiles = False
+    __default = None
+    __lock = threading.Lock()
+
+    # Private #
+    def __init__(self, dirpath=None, format=None, flushSize=None, flushInterval=None):
+        """
+        @param dirpath: directory of worker files (class dirpath if none)
+        @param format: jsonl, csv or parquet (class format if none)
+        @param flushSize: number of buffered results triggering a flush
+        @param flushInterval: seconds since the last flush triggering a flush on the next result
+        """
+        self.dirpath = os.path.realpath(dirpath or self.dirpath)
+        self.format = format or self.format
+        if self.format not in self.FORMATS:
+            raise ValueError('Format must be one of %s' % (self.FORMATS,))
+        self.flushSize = flushSize or self.flushSize
+        self.flushInterval = flushInterval or self.flushInterval
+        self.worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+        self.pid = os.getpid()
+        self.path = os.path.join(self.dirpath, '%s_%s_%s.%s' % (self.PREFIX, self.worker, self.pid, self.format))
+        self.files = []
+        self.count = 0
+        self.__lock = threading.RLock()
+        self.__columns = dict((column, []) for column in self.FIELDS)
+        self.__flushed = time.monotonic()
+        self.__writer = None
+
+    def __write(self, columns):
+        os.makedirs(self.dirpath, exist_ok=True)
+        if self.format != 'parquet' and self.path not in self.files:
+            self.files.append(self.path)
+        rows = zip(*(columns[column] for column in self.FIELDS))
+        if self.format == 'jsonl':
+            with open(self.path, 'a', encoding='utf-8') as fp:
+                for row in rows:
+                    fp.write(json.dumps(dict(zip(self.FIELDS, row)), default=str) + '\n')
+        elif self.format == 'csv':
+            header = not os.path.exists(self.path)
+            with open(self.path, 'a', encoding='utf-8', newline='') as fp:
+                writer = csv.writer(fp)
+                if header:
+                    writer.writerow(self.FIELDS)
+                writer.writerows(rows)
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.table(dict((column, [None if value is None else str(value) for value in columns[column]])
+                                       for column in self.FIELDS),
+                                  schema=pyarrow.schema([(column, pyarrow.string()) for column in self.FIELDS]))
+            if self.__writer is None:
+                # A closed parquet file can not be appended, each writer gets its own part file
+                path = '%s_%s.parquet' % (self.path[:-len('.parquet')], len(self.files))
+                self.__writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+                self.files.append(path)
+            self.__writer.write_table(table)
+
+    @staticmethod
+    def __scalar(value):
+        # numpy scalars (np.int64, np.float64...) are stored as their python value
+        if type(value).__module__ == 'numpy' and hasattr(value, 'item'):
+            return value.item()
+        return value
+
+    def __exit(self):
+        self.close()
+        if not self.keepFiles:
+            self.discard()
+
+    # Default sink of the process
+    @staticmethod
+    def default():
+        """
+        Return the sink of this process, created on first use
+        At exit it is closed, its files are removed unless keepFiles is set (by the pytest plugin)
+        A forked process gets its own sink since the file name is bound to the pid
+        @return: <ResultSink>
+        """
+        with ResultSink.__lock:
+            sink = ResultSink.__default
+            if sink is None or sink.pid != os.getpid():
+                sink = ResultSink.__default = ResultSink()
+                atexit.register(sink.__exit)
+        return sink
+
+    @staticmethod
+    def setDefault(sink):
+        """
+        Replace the sink of this process, the previous one is closed
+        @param sink: <ResultSink>
+        @return: sink
+        """
+        with ResultSink.__lock:
+            previous, ResultSink.__default = ResultSink.__default, sink
+        if previous is not None and previous is not sink:
+            previous.close()
+        return sink
+
+    # Results
+    def add(self, scenario, actual, expect):
+        """
+        Buffer a test result, flushed to the worker file when the buffer is full or old enough
+        @param scenario: description of the test scenario
+        @param actual: actual value
+        @param expect: expect value
+        @return: self
+        """
+        actual, expect = self.__scalar(actual), self.__scalar(expect)
+        with self.__lock:
+            self.__columns['Scenario'].append(str(scenario))
+            self.__columns['Actual'].append(actual)
+            self.__columns['Expect'].append(expect)
+            self.__columns['ActualType'].append(type(actual).__name__)
+            self.__columns['ExpectType'].append(type(expect).__name__)
+            self.count += 1
+            if len(self.__columns['Scenario']) >= self.flushSize \
+                    or time.monotonic() - self.__flushed >= self.flushInterval:
+                self.flush()
+        return self
+
+    def flush(self):
+        """
+        Append buffered results to the worker file
+        @return: self
+        """
+        with self.__lock:
+            columns = self.__columns
+            self.__flushed = time.monotonic()
+            if columns['Scenario']:
+                self.__columns = dict((column, []) for column in self.FIELDS)
+                self.__write(columns)
+        return self
+
+    def close(self):
+        """
+        Flush buffered results and close the worker file
+        @return: self
+        """
+        with self.__lock:
+            self.flush()
+            if self.__writer is not None:
+                self.__writer.close()
+                self.__writer = None
+        return self
+
+    def discard(self):
+        """
+        Close and remove the files of this sink (the directory too if it is left empty)
+        @return: self
+        """
+        with self.__lock:
+            self.close()
+            for path in self.files:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.files = []
+            try:
+                os.rmdir(self.dirpath)
+            except OSError:
+                pass
+        return self
+
+    def results(self):
+        """
+        Return results of this sink (flushed ones are read back from the worker file)
+        @return: <List>dict of Scenario, Actual, Expect
+        """
+        with self.__lock:
+            self.close()
+            return [row for path in self.files for row in self.read(path)]
+
+    # Worker files
+    @classmethod
+    def read(cls, path):
+        """
+        Read results of a worker/merged file, Actual/Expect values are converted back to their type if possible
+        @param path: file path, format is taken from its extension
+        @return: <List>dict of Scenario, Actual, Expect
+        """
+        if path.endswith('.jsonl'):
+            with open(path, encoding='utf-8') as fp:
+                rows = [json.loads(line) for line in fp if line.strip()]
+        elif path.endswith('.csv'):
+            with open(path, encoding='utf-8', newline='') as fp:
+                rows = list(csv.DictReader(fp))
+        else:
+            import pyarrow.parquet
+            rows = pyarrow.parquet.read_table(path).to_pylist()
+        return [{'Scenario': row['Scenario'],
+                 'Actual': cls.__restore(row['Actual'], row.get('ActualType')),
+                 'Expect': cls.__restore(row['Expect'], row.get('ExpectType'))} for row in rows]
+
+    @classmethod
+    def __restore(cls, value, typeName):
+        convert = cls.TYPES.get(typeName)
+        if convert is None or (value is None and typeName != 'NoneType'):
+            return value
+        try:
+            return convert(value)
+        except (ValueError, ArithmeticError):
+            return value
+
+    @classmethod
+    def workerFiles(cls, dirpath=None, format=None):
+        """
+        Return worker files in a directory
+        @return: <List>path
+        """
+        dirpath = os.path.realpath(dirpath or cls.dirpath)
+        return sorted(glob.glob(os.path.join(dirpath, '%s_*.%s' % (cls.PREFIX, format or cls.format))))
+
+    @classmethod
+    def clean(cls, dirpath=None, format=None):
+        """
+        Remove worker files left by a previous session
+        """
+        for path in cls.workerFiles(dirpath, format):
+            os.remove(path)
+
+    @classmethod
+    def merge(cls, dirpath=None, format=None, output=None, remove=True):
+        """
+        Combine worker files into one file, streaming them so memory stays bounded
+        @param dirpath: directory of worker files (class dirpath if none)
+        @param format: format of worker files (class format if none)
+        @param output: merged file path (<dirpath>/results.<format> if none)
+        @param remove: remove worker files once merged
+        @return: merged file path, None if there was no worker file
+        """
+        format = format or cls.format
+        files = cls.workerFiles(dirpath, format)
+        if not files:
+            return None
+        output = output or os.path.join(os.path.realpath(dirpath or cls.dirpath), '%s.%s' % (cls.PREFIX, format))
+        if format == 'parquet':
+            import pyarrow.parquet
+            writer = None
+            for path in files:
+                for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(output, batch.schema)
+                    writer.write_batch(batch)
+            if writer is not None:
+                writer.close()
+        else:
+            with open(output, 'w', encoding='utf-8', newline='') as out:
+                for index, path in enumerate(files):
+                    with open(path, encoding='utf-8', newline='') as fp:
+                        if format == 'csv' and index > 0:
+                            next(fp, None)
+                        for line in fp:
+                            out.write(line)
+        if remove:
+            for path in files:
+                os.remove(path)
+        return output
+
+
+# ------ Pytest plugin -------
+def pytest_addoption(parser):
+    group = parser.getgroup('resultsink', 'test results collection')
+    group.addoption('--results-dir', default=ResultSink.dirpath, help='directory of test result files')
+    group.addoption('--results-format', default=ResultSink.format, choices=ResultSink.FORMATS,
+                    help='format of test result files')
+
+
+def pytest_configure(config):
+    ResultSink.dirpath = config.getoption('results_dir')
+    ResultSink.format = config.getoption('results_format')
+    ResultSink.keepFiles = True
+    if not hasattr(config, 'workerinput'):
+        ResultSink.clean()
+
+
+def pytest_sessionfinish(session):
+    ResultSink.default().close()
+    if not hasattr(session.config, 'workerinput'):
+        # Controller (or single process run): workers are done, combine their files
+        ResultSink.merge()
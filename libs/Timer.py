@@ -0,0 +1,181 @@
+import csv
+import json
+import math
+import statistics
+import time
+
+
+class Timer(object):
+    """
+    High resolution checkpoint timer (time.perf_counter_ns) supporting repeated runs of the same flow
+    A run starts with a 'start' checkpoint, a segment is the duration from the previous checkpoint to a checkpoint
+    @author: Lex.Khuat
+    """
+    START = 'start'
+    STATS = ('count', 'min', 'median', 'p95', 'p99', 'mean', 'stdev', 'max')
+
+    # Private #
+    def __init__(self):
+        self.runs = []
+        self.runDetails = []
+        self.__details = None
+        self.__names = None
+        self.__labels = None
+        self.__times = None
+        self.reset()
+
+    @staticmethod
+    def percentile(values, percent):
+        """
+        Return the percentile of sorted values with linear interpolation between closest ranks
+        @param values: sorted list of numbers
+        @param percent: 0-100
+        @return: number
+        """
+        if not values:
+            return None
+        rank = (len(values) - 1) * percent / 100.0
+        low, high = int(math.floor(rank)), int(math.ceil(rank))
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    # Checkpoints
+    def reset(self):
+        """
+        Start a new run, the current run is kept in history if it recorded any checkpoint
+        @return: self
+        """
+        if self.__labels is not None and len(self.__labels) > 1:
+            self.runs.append(list(zip(self.__labels, self.__times)))
+            self.runDetails.append(self.__details)
+        self.__details = {}
+        self.__names = {self.START: 0}
+        self.__labels = [self.START]
+        self.__times = [time.perf_counter_ns()]
+        return self
+
+    def lap(self, checkpoint=None, details=None):
+        """
+        Record a checkpoint of the current run
+        @param checkpoint: name of the checkpoint (its position if none)
+        @param details: data to attach to the checkpoint (ex: browser timings)
+        @return: self
+        """
+        now = time.perf_counter_ns()
+        checkpoint = str(len(self.__labels)) if checkpoint is None else str(checkpoint)
+        if checkpoint in self.__names:
+            raise Exception('Checkpoint name already exists')
+        self.__names[checkpoint] = len(self.__labels)
+        self.__labels.append(checkpoint)
+        self.__times.append(now)
+        if details is not None:
+            self.__details[checkpoint] = details
+        return self
+
+    def details(self, checkpoint):
+        """
+        Return data attached to a checkpoint of the current run
+        @param checkpoint: checkpoint name
+        @return: data, None if nothing attached
+        """
+        return self.__details.get(str(checkpoint))
+
+    def index(self, checkpoint):
+        """
+        Find index of the checkpoint in the current run
+        @param checkpoint: checkpoint name
+        @return: int as index of the checkpoint, None if not found
+        """
+        return self.__names.get(str(checkpoint))
+
+    def checkpoints(self):
+        """
+        Return checkpoints of the current run
+        @return: <List>(name, perf_counter_ns)
+        """
+        return list(zip(self.__labels, self.__times))
+
+    def elapsed(self, check=None, lastcheck=None):
+        """
+        Get the duration between 2 checkpoints of the current run
+        @param check: to checkpoint (last checkpoint if none)
+        @param lastcheck: from checkpoint (checkpoint before check if none)
+        @return: duration in seconds
+        """
+        to = len(self.__labels) - 1 if check is None else self.__names[str(check)]
+        since = max(to - 1, 0) if lastcheck is None else self.__names[str(lastcheck)]
+        return (self.__times[to] - self.__times[since]) / 1e9
+
+    # Statistics
+    def segments(self, run=None):
+        """
+        Return segment durations of a run
+        @param run: list of (name, perf_counter_ns), the current run if none
+        @return: <List>(name, seconds)
+        """
+        run = self.checkpoints() if run is None else run
+        return [(run[i][0], (run[i][1] - run[i - 1][1]) / 1e9) for i in range(1, len(run))]
+
+    def allRuns(self):
+        """
+        Return finished runs plus the current one if it recorded any checkpoint
+        @return: <List>run
+        """
+        current = self.checkpoints()
+        return self.runs + ([current] if len(current) > 1 else [])
+
+    def samples(self):
+        """
+        Collect durations of each segment over all runs
+        @return: dict of segment: <List>seconds in run order
+        """
+        durations = {}
+        for run in self.allRuns():
+            for name, seconds in self.segments(run):
+                durations.setdefault(name, []).append(seconds)
+        return durations
+
+    def stats(self):
+        """
+        Aggregate each segment over all runs
+        @return: dict of segment: {count, min, median, p95, p99, mean, stdev, max} in seconds
+        """
+        result = {}
+        for name, values in self.samples().items():
+            values = sorted(values)
+            result[name] = {'count': len(values),
+                            'min': values[0],
+                            'median': statistics.median(values),
+                            'p95': self.percentile(values, 95),
+                            'p99': self.percentile(values, 99),
+                            'mean': statistics.mean(values),
+                            'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+                            'max': values[-1]}
+        return result
+
+    # Export
+    def export_json(self, path):
+        """
+        Export segment durations of every run and their statistics into a json file
+        @param path: file path
+        @return: self
+        """
+        details = self.runDetails + ([self.__details] if len(self.__labels) > 1 else [])
+        data = {'runs': [dict(self.segments(run)) for run in self.allRuns()],
+                'details': details,
+                'stats': self.stats()}
+        with open(path, 'w') as fp:
+            json.dump(data, fp, indent=2)
+        return self
+
+    def export_csv(self, path):
+        """
+        Export statistics of every segment into a csv file
+        @param path: file path
+        @return: self
+        """
+        with open(path, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(('segment',) + self.STATS)
+            for name, stats in self.stats().items():
+                writer.writerow((name,) + tuple(stats[key] for key in self.STATS))
+        return self
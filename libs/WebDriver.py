@@ -1,11 +1,148 @@
 import os
+import threading
+from collections import deque
+from contextlib import contextmanager
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import *
 
+# Javascript function to resolve a selenium locator (By strategy, expression) inside the page
+JS_FIND = """
+function find(by, value) {
+    switch (by) {
+        case 'xpath':
+            return document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+                .singleNodeValue;
+        case 'css selector':
+            return document.querySelector(value);
+        case 'id':
+            return document.getElementById(value);
+        case 'name':
+            return document.getElementsByName(value)[0] || null;
+        case 'class name':
+            return document.getElementsByClassName(value)[0] || null;
+        case 'tag name':
+            return document.getElementsByTagName(value)[0] || null;
+        case 'link text':
+            return Array.prototype.find.call(document.links, function (a) {
+                return a.innerText.trim() === value;
+            }) || null;
+        case 'partial link text':
+            return Array.prototype.find.call(document.links, function (a) {
+                return a.innerText.indexOf(value) >= 0;
+            }) || null;
+    }
+    throw new Error('Unsupported locator strategy: ' + by);
+}
+"""
+
+# Javascript waiting (execute_async_script) until an element condition holds, using a MutationObserver
+# plus a light in-page timer for style/layout changes which do not produce DOM mutations
+JS_OBSERVE = JS_FIND + """
+var by = arguments[0], value = arguments[1], condition = arguments[2], timeout = arguments[3] * 1000,
+    done = arguments[arguments.length - 1], observer = null, timer = null, poll = null, finished = false;
+function visible(el) {
+    if (el === null || !el.isConnected) {
+        return false;
+    }
+    var style = window.getComputedStyle(el);
+    return style.visibility !== 'hidden' && style.display !== 'none' && parseFloat(style.opacity) !== 0
+        && (el.offsetWidth > 0 || el.offsetHeight > 0 || el.getClientRects().length > 0);
+}
+function check() {
+    var el = find(by, value);
+    switch (condition) {
+        case 'visible': return visible(el);
+        case 'invisible': return !visible(el);
+        case 'presented': return el !== null;
+        case 'clickable': return visible(el) && !el.disabled;
+    }
+    throw new Error('Unsupported condition: ' + condition);
+}
+function finish(result) {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    if (observer !== null) {
+        observer.disconnect();
+    }
+    clearTimeout(timer);
+    clearInterval(poll);
+    done(result);
+}
+function test(last) {
+    try {
+        if (check() || last) {
+            finish(check());
+        }
+    } catch (e) {
+        finish({'error': e.message});
+    }
+}
+test(timeout <= 0);
+if (!finished) {
+    observer = new MutationObserver(function () { test(false); });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    poll = setInterval(function () { test(false); }, 100);
+    timer = setTimeout(function () { test(true); }, timeout);
+}
+"""
+
+# Javascript reading browser side timings of the current page
+JS_TIMINGS = """
+var data = {'url': window.location.href};
+['navigation', 'resource', 'paint'].forEach(function (type) {
+    data[type] = performance.getEntriesByType(type).map(function (e) { return e.toJSON(); });
+});
+data.longtask = [];
+if (window.PerformanceObserver && (PerformanceObserver.supportedEntryTypes || []).indexOf('longtask') >= 0) {
+    var observer = new PerformanceObserver(function () {});
+    observer.observe({type: 'longtask', buffered: true});
+    data.longtask = observer.takeRecords().map(function (e) { return e.toJSON(); });
+    observer.disconnect();
+}
+return data;
+"""
+
+
+class CachedElement(WebElement):
+    """
+        WebElement kept in WebDriver element cache
+        Transparently re-resolves its locator once when the element went stale
+        @author: Lex.Khuat
+    """
+
+    def __init__(self, element, locator, stats):
+        self.__dict__.update(element.__dict__)
+        self.locator = locator
+        self.stats = stats
+
+    def __refresh__(self):
+        self.stats['stale'] += 1
+        self.__dict__.update(self._parent.find_element(*self.locator).__dict__)
+
+    def __retry__(self, method, *args):
+        try:
+            return method(self, *args)
+        except StaleElementReferenceException:
+            self.__refresh__()
+            return method(self, *args)
+
+    def _execute(self, command, params=None):
+        return self.__retry__(WebElement._execute, command, params)
+
+    # Selenium 4 (w3c) runs these through parent.execute_script instead of _execute
+    def get_attribute(self, name):
+        return self.__retry__(WebElement.get_attribute, name)
+
+    def is_displayed(self):
+        return self.__retry__(WebElement.is_displayed)
+
 
 class WebDriver(object):
     """
@@ -14,6 +151,16 @@ class WebDriver(object):
     """
     driver = None
     downloadPath = None
+    pool = None
+    reuses = 0
+    waitMode = 'poll'
+    # Async script timeout of the session (seconds), kept since selenium 3 can not read it back
+    scriptTimeout = 30
+    collectTimings = False
+    __timings = None
+    __asyncScripts = True
+    __elements = None
+    __cacheStats = None
 
     # Private #
     def __init__(self, browser):
@@ -22,6 +169,51 @@ class WebDriver(object):
     def __wait__(self, timeout):
         return WebDriverWait(self.driver, timeout)
 
+    def __observe__(self, locator, condition, timeout):
+        """
+        Wait for an element condition inside the page (waitMode 'observer')
+        @return: bool, or None if the caller must fall back to WebDriverWait polling
+        """
+        if self.waitMode != 'observer' or not timeout or not self.__asyncScripts:
+            return None
+        try:
+            previous = self.driver.timeouts.script
+        except (AttributeError, WebDriverException):
+            previous = self.scriptTimeout
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            result = self.driver.execute_async_script(JS_OBSERVE, locator[0], locator[1], condition, timeout)
+        except TimeoutException:
+            return False
+        except JavascriptException:
+            return None
+        except WebDriverException as e:
+            # Only give up observer mode if the driver does not support async scripts,
+            # other errors (ex: page navigated during the wait) fall back to polling this time
+            message = str(e).lower()
+            if isinstance(e, UnknownMethodException) \
+                    or any(text in message for text in ('unknown command', 'unknown method', 'not implemented')):
+                self.__asyncScripts = False
+            return None
+        finally:
+            try:
+                self.driver.set_script_timeout(previous)
+            except WebDriverException:
+                pass
+        if isinstance(result, dict):
+            return None
+        return bool(result)
+
+    def __execute_on__(self, jsScript, locator, *args):
+        try:
+            return self.driver.execute_script(jsScript, self.find(locator), *args)
+        except StaleElementReferenceException:
+            if self.__elements is None:
+                raise
+            self.__cacheStats['stale'] += 1
+            self.__elements.pop(tuple(locator), None)
+            return self.driver.execute_script(jsScript, self.find(locator), *args)
+
     # Browser
     def setDownloadPath(self, dirPath):
         """
@@ -58,9 +250,9 @@ class WebDriver(object):
             self.driver = webdriver.Chrome(options=options,
                                            desired_capabilities=capabilities,
                                            service_log_path=os.path.devnull)
+            self.driver.command_executor._commands["send_command"] \
+                = ("POST", '/session/$sessionId/chromium/send_command')
             if headless:
-                self.driver.command_executor._commands["send_command"] \
-                    = ("POST", '/session/$sessionId/chromium/send_command')
                 params = {'cmd': 'Page.setDownloadBehavior', 'params': {
                     'behavior': 'allow', 'downloadPath': self.downloadPath}}
                 self.driver.execute("send_command", params)
@@ -72,9 +264,45 @@ class WebDriver(object):
     def quit(self):
         """
         Close the web driver
+        A pooled session is returned to its pool instead of being closed
+        @return: self
+        """
+        if self.pool is not None:
+            self.pool.checkin(self)
+        else:
+            self.driver.quit()
+        return self
+
+    def reset(self):
+        """
+        Reset the browser to a clean state without closing it:
+        close extra windows, clear cookies, web storage (of every origin on chrome) and cache, navigate to
+        about:blank, then restore default wait mode, performance timing and element cache settings
         @return: self
         """
-        self.driver.quit()
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+        try:
+            self.driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+        except WebDriverException:
+            pass
+        if self.browser in ('chrome', 'gc', 'google chrome'):
+            # Storage of every origin (page script only reaches the current one), cache and cookies
+            for cmd, params in (('Storage.clearDataForOrigin', {'origin': '*', 'storageTypes': 'all'}),
+                                ('Network.clearBrowserCache', {}),
+                                ('Network.clearBrowserCookies', {})):
+                self.driver.execute("send_command", {'cmd': cmd, 'params': params})
+        else:
+            self.driver.delete_all_cookies()
+        self.clear_element_cache()
+        self.driver.get('about:blank')
+        self.set_wait_mode(WebDriver.waitMode)
+        self.enable_performance_timing(False)
+        self.__timings = None
+        self.enable_element_cache(False)
         return self
 
     def clear_all_cookies(self):
@@ -136,6 +364,66 @@ class WebDriver(object):
         """
         return self.driver.page_source
 
+    def enable_performance_timing(self, enabled=True):
+        """
+        Turn on/off collecting browser side timings after each get (see get_performance_timing)
+        @param enabled: True/False
+        @return: self
+        """
+        self.collectTimings = enabled
+        if enabled:
+            if self.__timings is None:
+                self.__timings = []
+            if self.browser in ('chrome', 'gc', 'google chrome'):
+                self.driver.execute("send_command", {'cmd': 'Performance.enable', 'params': {}})
+        return self
+
+    def get_performance_timing(self):
+        """
+        Return browser side timings of the current page: navigation, resource, paint and longtask entries
+        of the Performance API, plus chrome metrics (Performance.getMetrics) in 'metrics'
+        @return: dict
+        """
+        timing = self.driver.execute_script(JS_TIMINGS)
+        timing['metrics'] = self.get_browser_metrics()
+        return timing
+
+    def get_browser_metrics(self):
+        """
+        Return chrome runtime metrics (Performance.getMetrics through send_command). Only support chrome
+        @return: dict of metric name: value
+        """
+        if self.browser not in ('chrome', 'gc', 'google chrome'):
+            return {}
+        try:
+            response = self.driver.execute("send_command", {'cmd': 'Performance.getMetrics', 'params': {}})
+        except WebDriverException:
+            return {}
+        return dict((item['name'], item['value']) for item in response['value'].get('metrics', []))
+
+    def pop_performance_timings(self):
+        """
+        Return timings collected by get since the last call, and clear them
+        @return: <List>dict
+        """
+        timings = self.__timings or []
+        self.__timings = [] if self.__timings is not None else None
+        return timings
+
+    def set_wait_mode(self, mode):
+        """
+        Set how is_visible/is_invisible/is_presented/is_clickable wait
+        - poll: WebDriverWait querying the element every 500ms
+        - observer: a MutationObserver inside the page which resolves as soon as the condition holds
+                    (one round-trip per wait, fall back to poll if async scripts are unavailable)
+        @param mode: 'poll' or 'observer'
+        @return: self
+        """
+        if mode not in ('poll', 'observer'):
+            raise ValueError('Wait mode must be poll or observer: %s' % mode)
+        self.waitMode = mode
+        return self
+
     # Page navigation
     def get(self, url):
         """
@@ -143,7 +431,10 @@ class WebDriver(object):
         @param url: url to navigate
         @return: self
         """
+        self.clear_element_cache()
         self.driver.get(url)
+        if self.collectTimings:
+            self.__timings.append(self.get_performance_timing())
         return self
 
     def refresh(self):
@@ -151,6 +442,7 @@ class WebDriver(object):
         Refresh current page
         @return: self
         """
+        self.clear_element_cache()
         self.driver.refresh()
         return self
 
@@ -159,6 +451,7 @@ class WebDriver(object):
         Go forward (after go back)
         @return: self
         """
+        self.clear_element_cache()
         self.driver.forward()
         return self
 
@@ -167,6 +460,7 @@ class WebDriver(object):
         Go back to previous page
         @return: self
         """
+        self.clear_element_cache()
         self.driver.back()
         return self
 
@@ -174,10 +468,52 @@ class WebDriver(object):
     def find(self, locator):
         """
         Find and return matched element
+        Found elements are reused from the element cache if it is enabled
         @param locator: By.By, Expression to find in tuple
         @return: element
         """
-        return self.driver.find_element(*locator)
+        if self.__elements is None:
+            return self.driver.find_element(*locator)
+        key = tuple(locator)
+        element = self.__elements.get(key)
+        if element is None:
+            self.__cacheStats['misses'] += 1
+            element = CachedElement(self.driver.find_element(*key), key, self.__cacheStats)
+            self.__elements[key] = element
+        else:
+            self.__cacheStats['hits'] += 1
+        return element
+
+    def enable_element_cache(self, enabled=True):
+        """
+        Turn on/off caching of found elements by locator for the current page
+        The cache is cleared on every page navigation (get, refresh, back, forward)
+        @param enabled: True/False
+        @return: self
+        """
+        if enabled:
+            if self.__elements is None:
+                self.__elements = {}
+                self.__cacheStats = {'hits': 0, 'misses': 0, 'stale': 0}
+        else:
+            self.__elements = None
+        return self
+
+    def clear_element_cache(self):
+        """
+        Drop all cached elements
+        @return: self
+        """
+        if self.__elements is not None:
+            self.__elements.clear()
+        return self
+
+    def get_cache_stats(self):
+        """
+        Return element cache counters: hits, misses and stale re-resolves
+        @return: dict
+        """
+        return dict(self.__cacheStats or {'hits': 0, 'misses': 0, 'stale': 0})
 
     # Element condition status
     def is_visible(self, locator, timeout=0):
@@ -187,6 +523,9 @@ class WebDriver(object):
         @param timeout: waiting time (seconds)
         @return: bool
         """
+        observed = self.__observe__(locator, 'visible', timeout)
+        if observed is not None:
+            return observed
         try:
             return self.__wait__(timeout).until(EC.visibility_of_element_located(locator)) is not None
         except WebDriverException as e:
@@ -200,6 +539,9 @@ class WebDriver(object):
         @param timeout: waiting time (seconds)
         @return: bool
         """
+        observed = self.__observe__(locator, 'invisible', timeout)
+        if observed is not None:
+            return observed
         try:
             return self.__wait__(timeout).until(EC.invisibility_of_element_located(locator)) is not None
         except WebDriverException as e:
@@ -212,6 +554,9 @@ class WebDriver(object):
         @param timeout: waiting time (seconds)
         @return: bool
         """
+        observed = self.__observe__(locator, 'presented', timeout)
+        if observed is not None:
+            return observed
         try:
             return self.__wait__(timeout).until(EC.presence_of_element_located(locator)) is not None
         except WebDriverException as e:
@@ -236,6 +581,9 @@ class WebDriver(object):
         @param timeout: waiting time (seconds)
         @return: bool
         """
+        observed = self.__observe__(locator, 'clickable', timeout)
+        if observed is not None:
+            return observed
         try:
             return self.__wait__(timeout).until(EC.element_to_be_clickable(locator)) is not None
         except WebDriverException as e:
@@ -248,9 +596,56 @@ class WebDriver(object):
         @return: bool
         """
         jsScript = "return arguments[0].checked;"
-        return self.driver.execute_script(jsScript, self.find(locator))
+        return self.__execute_on__(jsScript, locator)
 
     # Get element info
+    def get_elements_info(self, locators, properties=('text',)):
+        """
+        Read properties of many elements in a single javascript round-trip
+        Supported properties: text, innertext, value, tagname, html, checked,
+        any other name is read as element property or attribute (like get_attribute)
+        @param locators: dict of name: locator
+        @param properties: list of properties to read for all locators,
+                           or dict of name: list of properties for each locator
+        @return: dict of name: {property: value}, or name: {'error': message} if the element can not be read
+        """
+        requests = []
+        for name, locator in locators.items():
+            props = properties.get(name, ('text',)) if isinstance(properties, dict) else properties
+            requests.append([name, locator[0], locator[1], list(props)])
+        jsScript = JS_FIND + """
+        function read(el, prop) {
+            switch (prop) {
+                case 'text': return (el.innerText || '').trim();
+                case 'innertext': return el.innerText;
+                case 'tagname': return el.tagName.toLowerCase();
+                case 'html': return el.innerHTML;
+                case 'checked': return el.checked;
+            }
+            var val = el[prop];
+            if (val === undefined || (val !== null && typeof val === 'object')) {
+                return el.getAttribute(prop);
+            }
+            return val;
+        }
+        var result = {};
+        arguments[0].forEach(function (req) {
+            try {
+                var el = find(req[1], req[2]);
+                if (el === null) {
+                    throw new Error('Unable to locate element: ' + req[2]);
+                }
+                var info = {};
+                req[3].forEach(function (prop) { info[prop] = read(el, prop); });
+                result[req[0]] = info;
+            } catch (e) {
+                result[req[0]] = {'error': e.message};
+            }
+        });
+        return result;
+        """
+        return self.driver.execute_script(jsScript, requests)
+
     def get_text(self, locator):
         """
         Return the text value of the element
@@ -266,7 +661,7 @@ class WebDriver(object):
         @return: string
         """
         jsScript = 'return arguments[0].innerText;'
-        return self.driver.execute_script(jsScript, self.find(locator))
+        return self.__execute_on__(jsScript, locator)
 
     def get_attribute(self, locator, attribute):
         """
@@ -318,7 +713,7 @@ class WebDriver(object):
         @param value: new value to set
         """
         jsScript = "arguments[0].setAttribute('" + attribute + "','" + value + "');"
-        self.driver.execute_script(jsScript, self.find(locator))
+        self.__execute_on__(jsScript, locator)
 
     def set_text(self, locator, value):
         """
@@ -327,7 +722,7 @@ class WebDriver(object):
         @param value: new value to set
         """
         jsScript = "arguments[0].textContent = " + value + ";"
-        self.driver.execute_script(jsScript, self.find(locator))
+        self.__execute_on__(jsScript, locator)
 
     # Form action
     def input_text(self, locator, text):
@@ -450,6 +845,16 @@ class WebDriver(object):
         """
         return self.driver.execute_script(script)
 
+    def set_script_timeout(self, seconds):
+        """
+        Set the timeout of async javascripts
+        @param seconds: timeout (seconds)
+        @return: self
+        """
+        self.scriptTimeout = seconds
+        self.driver.set_script_timeout(seconds)
+        return self
+
     def execute_async_javascript(self, script):
         """
         Execute an async javascript on current page
@@ -457,3 +862,164 @@ class WebDriver(object):
         @return: executed status
         """
         return self.driver.execute_async_script(script)
+
+
+class WebDriverPool(object):
+    """
+        Pool of launched WebDriver sessions which are reused across tests instead of relaunching the browser
+        Sessions are reset (not quit) on return and retired after reaching the reuse limit
+        @author: Lex.Khuat
+    """
+
+    # Private #
+    def __init__(self, browser, downloadPath, headless=False, maxSize=4, maxReuse=50):
+        if maxSize < 1:
+            raise ValueError('Pool size must be at least 1')
+        self.browser = browser
+        self.downloadPath = downloadPath
+        self.headless = headless
+        self.maxSize = maxSize
+        self.maxReuse = maxReuse
+        self.__idle = deque()
+        self.__busy = set()
+        self.__launching = 0
+        self.__returning = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def __launch__(self):
+        engine = WebDriver(self.browser).setDownloadPath(self.downloadPath).launch(self.headless)
+        engine.pool = self
+        return engine
+
+    def __retire__(self, engine):
+        engine.pool = None
+        try:
+            engine.driver.quit()
+        except WebDriverException:
+            pass
+
+    def __total(self):
+        return len(self.__idle) + len(self.__busy) + self.__launching + self.__returning
+
+    # Pool
+    def warm(self, count=None):
+        """
+        Pre-launch idle sessions so the first checkouts do not pay the browser startup
+        @param count: number of sessions to have ready (pool size if none)
+        @return: self
+        """
+        count = self.maxSize if count is None else min(count, self.maxSize)
+        while True:
+            with self.__condition:
+                if self.__closed or len(self.__idle) + self.__launching >= count \
+                        or self.__total() >= self.maxSize:
+                    return self
+                self.__launching += 1
+            try:
+                engine = self.__launch__()
+            finally:
+                with self.__condition:
+                    self.__launching -= 1
+            with self.__condition:
+                self.__idle.append(engine)
+                self.__condition.notify()
+
+    def checkout(self, timeout=None):
+        """
+        Take a session from the pool, launch a new one if the pool is not full
+        @param timeout: seconds to wait for a free session (wait forever if none)
+        @return: <WebDriver> pooled session
+        """
+        with self.__condition:
+            while True:
+                if self.__closed:
+                    raise WebDriverException('WebDriver pool is closed')
+                if self.__idle:
+                    engine = self.__idle.popleft()
+                    self.__busy.add(engine)
+                    return engine
+                if self.__total() < self.maxSize:
+                    self.__launching += 1
+                    break
+                if not self.__condition.wait(timeout):
+                    raise WebDriverException('No free session in pool after %s seconds' % timeout)
+        try:
+            engine = self.__launch__()
+        finally:
+            with self.__condition:
+                self.__launching -= 1
+                self.__condition.notify()
+        with self.__condition:
+            self.__busy.add(engine)
+        return engine
+
+    def checkin(self, engine):
+        """
+        Return a session to the pool. The session is reset for the next test,
+        or quit if it reached the reuse limit or failed to reset
+        A session which is not checked out (already returned, ex: quit() inside session()) is ignored
+        @param engine: <WebDriver> session taken from this pool
+        @return: self
+        """
+        if engine.pool is not self:
+            raise ValueError('%s was not checked out from this pool' % engine)
+        with self.__condition:
+            if engine not in self.__busy:
+                return self
+            self.__busy.discard(engine)
+            self.__returning += 1
+        engine.reuses += 1
+        reusable = False
+        try:
+            reusable = not self.__closed and engine.reuses < self.maxReuse
+            if reusable:
+                try:
+                    engine.reset()
+                except WebDriverException:
+                    reusable = False
+        finally:
+            if not reusable:
+                self.__retire__(engine)
+            with self.__condition:
+                self.__returning -= 1
+                if reusable:
+                    self.__idle.append(engine)
+                self.__condition.notify()
+        return self
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+        Checkout a session and return it to the pool at the end of "with" block
+        @param timeout: seconds to wait for a free session
+        """
+        engine = self.checkout(timeout)
+        try:
+            yield engine
+        finally:
+            self.checkin(engine)
+
+    def close(self):
+        """
+        Quit all idle sessions. Sessions in use are quit when they are returned
+        @return: self
+        """
+        with self.__condition:
+            self.__closed = True
+            idle, self.__idle = list(self.__idle), deque()
+            self.__condition.notify_all()
+        for engine in idle:
+            self.__retire__(engine)
+        return self
+
+    def stats(self):
+        """
+        Return current pool usage
+        @return: dict
+        """
+        with self.__condition:
+            return {'idle': len(self.__idle),
+                    'busy': len(self.__busy),
+                    'launching': self.__launching,
+                    'maxSize': self.maxSize}
@@ -1,5 +1,10 @@
+import warnings
 from abc import ABC
-from pandas import DataFrame
+from numpy import isclose, nan
+from pandas import DataFrame, Series, concat, to_datetime, to_numeric
+from pandas.api.types import infer_dtype, is_object_dtype, is_string_dtype
+from pandas.util import hash_pandas_object
+from pymysql.constants import FIELD_TYPE
 from pymysql.cursors import Cursor
 from sqlalchemy.engine import ResultProxy
 
@@ -8,9 +13,23 @@ class Table(DataFrame, ABC):
     """
     pandas.DataFrame inherited class defines a result table from db
     """
+    CHUNK_SIZE = 10000
+    NORMALIZERS = {'strip': lambda s: s.astype(str).str.strip(),
+                   'lower': lambda s: s.astype(str).str.strip().str.lower(),
+                   'upper': lambda s: s.astype(str).str.strip().str.upper(),
+                   'numeric': lambda s: to_numeric(s, errors='coerce'),
+                   'datetime': lambda s: to_datetime(s, errors='coerce')}
+    # Column dtypes fixed up front from pymysql cursor description, other types are kept as python objects
+    FIELD_DTYPES = {FIELD_TYPE.TINY: 'Int64', FIELD_TYPE.SHORT: 'Int64', FIELD_TYPE.LONG: 'Int64',
+                    FIELD_TYPE.INT24: 'Int64', FIELD_TYPE.LONGLONG: 'Int64', FIELD_TYPE.YEAR: 'Int64',
+                    FIELD_TYPE.FLOAT: 'float64', FIELD_TYPE.DOUBLE: 'float64'}
+    # Column dtypes inferred from the first chunk when the driver gives no type codes (pandas infer_dtype names)
+    INFERRED_DTYPES = {'integer': 'Int64', 'floating': 'float64', 'mixed-integer-float': 'float64'}
 
     def __init__(self, source, **kwargs):
-        if isinstance(source, ResultProxy):
+        if isinstance(source, (DataFrame, dict)):
+            kwargs.update({'data': source})
+        elif isinstance(source, ResultProxy):
             kwargs.update({'data': source, 'columns': source.keys()})
         elif isinstance(source, Cursor):
             kwargs.update({'data': source.fetchall(), 'columns': [i[0] for i in source.description]})
@@ -19,3 +38,275 @@ class Table(DataFrame, ABC):
         elif isinstance(source, list) and isinstance(source[0], dict):
             kwargs.update({'data': [list(r.values()) for r in source], 'columns': list(source[0].keys())})
         super(Table, self).__init__(**kwargs)
+
+    @staticmethod
+    def __columns__(source):
+        if isinstance(source, Cursor):
+            return [i[0] for i in source.description]
+        return list(source.keys())
+
+    @staticmethod
+    def __dtypes__(source, columns, dtypes):
+        """
+        Return the dtype of each column: from pymysql type codes (Cursor, or the dbapi cursor of a ResultProxy),
+        None when the driver gives no type codes (inferred from the first chunk, see __pin__)
+        """
+        cursor = source if isinstance(source, Cursor) else getattr(source, 'cursor', None)
+        if isinstance(cursor, Cursor) and cursor.description:
+            fixed = [Table.FIELD_DTYPES.get(i[1], object) for i in cursor.description]
+        else:
+            fixed = [None] * len(columns)
+        for i, col in enumerate(columns):
+            if dtypes and col in dtypes:
+                fixed[i] = dtypes[col]
+        return fixed
+
+    @staticmethod
+    def __pin__(rows, dtypes):
+        """
+        Resolve dtypes left to inference from the values of a chunk, later chunks are built with the same dtypes
+        """
+        if None not in dtypes:
+            return dtypes
+        values = list(zip(*rows)) if rows else [()] * len(dtypes)
+        return [Table.INFERRED_DTYPES.get(infer_dtype(values[i], skipna=True), object) if dtype is None else dtype
+                for i, dtype in enumerate(dtypes)]
+
+    @staticmethod
+    def __chunk__(rows, columns, dtypes):
+        """
+        Build a frame column by column from a list of rows
+        A column whose values no longer fit its pinned dtype is kept as python objects for this chunk
+        """
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        series = {}
+        for i, dtype in enumerate(dtypes):
+            try:
+                series[i] = Series(values[i], dtype=dtype)
+            except (TypeError, ValueError):
+                series[i] = Series(values[i], dtype=object)
+        frame = DataFrame(series)
+        frame.columns = columns
+        return frame
+
+    @classmethod
+    def from_cursor(cls, source, chunksize=CHUNK_SIZE, dtypes=None):
+        """
+        Build a table from a db cursor (pymysql Cursor/SSCursor) or ResultProxy, reading it by fetchmany chunks
+        With a server-side cursor (SSCursor) the full result set is never held as python rows
+        @param source: cursor or ResultProxy with a pending result
+        @param chunksize: number of rows per fetch
+        @param dtypes: dict of column: dtype, overrides dtypes detected from cursor description
+        @return: <Table>
+        """
+        columns = cls.__columns__(source)
+        fixed = cls.__dtypes__(source, columns, dtypes)
+        chunks = []
+        for rows in cls.__fetch__(source, chunksize):
+            fixed = cls.__pin__(rows, fixed)
+            chunks.append(cls.__chunk__(rows, columns, fixed))
+        if not chunks:
+            return cls(cls.__chunk__([], columns, cls.__pin__([], fixed)))
+        return cls(concat(chunks, ignore_index=True))
+
+    @classmethod
+    def iter_cursor(cls, source, chunksize=CHUNK_SIZE, dtypes=None):
+        """
+        Generate tables of at most chunksize rows from a db cursor or ResultProxy, all with the same dtypes
+        Used to compare big results chunk by chunk in bounded memory
+        @param source: cursor or ResultProxy with a pending result
+        @param chunksize: number of rows per table
+        @param dtypes: dict of column: dtype, overrides dtypes detected from cursor description
+        @return: generator of <Table>
+        """
+        columns = cls.__columns__(source)
+        fixed = cls.__dtypes__(source, columns, dtypes)
+        for rows in cls.__fetch__(source, chunksize):
+            fixed = cls.__pin__(rows, fixed)
+            yield cls(cls.__chunk__(rows, columns, fixed))
+
+    @staticmethod
+    def __fetch__(source, chunksize):
+        while True:
+            rows = source.fetchmany(chunksize)
+            if not rows:
+                return
+            yield rows
+
+    @staticmethod
+    def __is_text__(values):
+        # object columns, or string dtype columns (default for text since pandas 3)
+        return is_object_dtype(values.dtype) or is_string_dtype(values.dtype)
+
+    def convert_types(self, dtypes='infer'):
+        """
+        Convert columns in bulk, typically string columns parsed from html
+        @param dtypes: 'infer' to detect numeric then datetime columns among text columns,
+                       or dict of column: dtype ('numeric', 'datetime' or any pandas dtype)
+        @return: self
+        """
+        if dtypes == 'infer':
+            dtypes = {col: 'infer' for col in self.columns if Table.__is_text__(self[col])}
+        for col, dtype in dtypes.items():
+            values = self[col]
+            if dtype not in ('infer', 'numeric', 'datetime'):
+                self[col] = values.astype(dtype)
+                continue
+            if Table.__is_text__(values):
+                if infer_dtype(values, skipna=True) in ('string', 'mixed', 'mixed-integer'):
+                    # .str gives NaN for non str cells, they keep their value
+                    stripped = values.str.strip()
+                    values = stripped.where(stripped.notna(), values)
+                values = values.where(values != '')
+            blanks = values.isna()
+            if dtype in ('infer', 'numeric'):
+                converted = to_numeric(values, errors='coerce')
+                if dtype == 'numeric' or not (converted.isna() & ~blanks).any():
+                    self[col] = converted
+                    continue
+            with warnings.catch_warnings():
+                # Probing a plain text column warns that no datetime format could be inferred
+                warnings.filterwarnings('ignore', message='Could not infer format', category=UserWarning)
+                converted = to_datetime(values, errors='coerce')
+            if dtype == 'datetime' or not (converted.isna() & ~blanks).any():
+                self[col] = converted
+        return self
+
+    def __normalized__(self, columns, normalize):
+        frame = DataFrame({col: self[col] for col in columns}, columns=columns)
+        for col, rule in normalize.items():
+            if col in frame:
+                rule = Table.NORMALIZERS[rule] if isinstance(rule, str) else rule
+                frame[col] = rule(frame[col])
+        return frame
+
+    @staticmethod
+    def __keys__(left, right, keys):
+        """
+        Cast key columns of both sides to a common dtype, equal keys must hash the same
+        (ex: int64 ids parsed from html vs object ids read from a cursor, 1 vs 1.0)
+        """
+        left, right = left[keys].copy(), right[keys].copy()
+        for col in keys:
+            a, b = left[col].infer_objects(), right[col].infer_objects()
+            if a.dtype.kind in 'iu' and b.dtype.kind in 'iu':
+                a, b = a.astype('Int64'), b.astype('Int64')
+            elif a.dtype.kind in 'iuf' and b.dtype.kind in 'iuf':
+                a, b = a.astype('Float64'), b.astype('Float64')
+            elif Table.__is_text__(a) and Table.__is_text__(b):
+                a, b = a.astype(str), b.astype(str)
+            elif a.dtype != b.dtype:
+                raise ValueError('Key column %s has incompatible dtypes: %s in actual, %s in expect table'
+                                 % (col, a.dtype, b.dtype))
+            left[col], right[col] = a, b
+        return left, right
+
+    def diff(self, expect, keys, columns=None, tolerance=None, normalize=None):
+        """
+        Compare this table (actual) with an expected table, rows are matched by key columns.
+        Key columns are hashed to one int per row, so matching is a vectorized lookup instead of nested loops
+        Key columns are cast to a common numeric or text dtype first, ValueError if they can not be
+        @param expect: <Table>/DataFrame expected result
+        @param keys: column name or list of key column names, must identify rows uniquely in both tables
+        @param columns: columns to compare (all common non key columns if none)
+        @param tolerance: absolute tolerance of numeric columns, a number for all or dict of column: tolerance
+        @param normalize: dict of column: rule applied on both sides before comparing (keys included),
+                          rule is one of NORMALIZERS names or a function taking and returning a Series
+        @return: <TableDiff>
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        if columns is None:
+            columns = [col for col in self.columns if col in expect.columns and col not in keys]
+        normalize = normalize or {}
+        left = Table.__normalized__(self, keys + columns, normalize)
+        right = Table.__normalized__(expect, keys + columns, normalize)
+        left_keys, right_keys = Table.__keys__(left, right, keys)
+        left_hash = hash_pandas_object(left_keys, index=False).values
+        right_hash = hash_pandas_object(right_keys, index=False).values
+        for name, hashes in (('actual', left_hash), ('expect', right_hash)):
+            if Series(hashes).duplicated().any():
+                raise ValueError('Key columns %s are not unique in %s table' % (keys, name))
+        left.index = left_hash
+        right.index = right_hash
+
+        in_right = left.index.isin(right.index)
+        in_left = right.index.isin(left.index)
+        added = Table(DataFrame(self).iloc[~in_right])
+        removed = Table(DataFrame(expect).iloc[~in_left])
+
+        common = left.index[in_right]
+        left = left.loc[common]
+        right = right.loc[common]
+        mask = DataFrame(index=common)
+        for col in columns:
+            a, b = left[col], right[col]
+            tol = tolerance.get(col) if isinstance(tolerance, dict) else tolerance
+            a_na, b_na = a.isna().to_numpy(bool), b.isna().to_numpy(bool)
+            if tol is not None and a.dtype.kind in 'iuf' and b.dtype.kind in 'iuf':
+                equal = isclose(a.to_numpy(float, na_value=nan), b.to_numpy(float, na_value=nan), rtol=0, atol=tol)
+            else:
+                # Nullable dtypes (Int64...) compare to <NA> when a side is missing, counted as different
+                equal = a.eq(b).fillna(False).to_numpy(bool)
+            mask[col] = (~equal & ~(a_na & b_na)) | (a_na ^ b_na)
+        mask.index = left[keys].set_index(keys).index
+
+        rows = mask.any(axis=1).values
+        changed = DataFrame(left[keys].values[rows], columns=keys)
+        for col in columns:
+            changed[col + '_actual'] = left[col].values[rows]
+            changed[col + '_expect'] = right[col].values[rows]
+        return TableDiff(keys, added, removed, Table(changed), mask)
+
+
+class TableDiff(object):
+    """
+    Result of Table.diff
+    - added: actual rows without matching key in expect table
+    - removed: expect rows without matching key in actual table
+    - changed: matched rows with at least one different cell (key, <column>_actual, <column>_expect columns)
+    - mask: True for each different cell of matched rows, indexed by key columns
+    """
+
+    def __init__(self, keys, added, removed, changed, mask):
+        self.keys = keys
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.mask = mask
+
+    def is_equal(self):
+        """
+        Return True if both tables have the same keys and values
+        @return: bool
+        """
+        return self.added.empty and self.removed.empty and self.changed.empty
+
+    def summary(self):
+        """
+        Return number of added/removed/changed rows and different cells
+        @return: dict
+        """
+        return {'added': len(self.added),
+                'removed': len(self.removed),
+                'changed': len(self.changed),
+                'cells': int(self.mask.values.sum())}
+
+    def results(self, scenario):
+        """
+        Generate (scenario, actual, expect) of every difference to store with BaseTest.add_testResult
+        @param scenario: description of the test scenario
+        @return: generator of tuple
+        """
+        for row in self.added.to_dict('records'):
+            yield '%s - added %s' % (scenario, [row.get(k) for k in self.keys]), row, None
+        for row in self.removed.to_dict('records'):
+            yield '%s - removed %s' % (scenario, [row.get(k) for k in self.keys]), None, row
+        changed_mask = self.mask[self.mask.any(axis=1)]
+        for position, (index, flags) in enumerate(zip(changed_mask.index, changed_mask.values)):
+            row = self.changed.iloc[position]
+            key = list(index) if isinstance(index, tuple) else [index]
+            for col, different in zip(changed_mask.columns, flags):
+                if different:
+                    yield '%s - %s %s' % (scenario, col, key), row[col + '_actual'], row[col + '_expect']
+
+    is_equal = property(is_equal)
@@ -0,0 +1,31 @@
+from decimal import Decimal
+import numpy
+import pytest
+from pandas import DataFrame
+from core.libs.ResultSink import ResultSink
+
+
+@pytest.mark.parametrize('format', ResultSink.FORMATS)
+def test_round_trip_keeps_value_types(tmp_path, format):
+    if format == 'parquet':
+        pytest.importorskip('pyarrow')
+    table = DataFrame({'q': [5], 'price': [1.5]})
+    sink = ResultSink(dirpath=str(tmp_path), format=format)
+    sink.add('numpy int', table['q'].iloc[0], 5)
+    sink.add('numpy float', numpy.float64(1.5), table['price'].iloc[0])
+    sink.add('python', Decimal('1.10'), None)
+    sink.add('flags', numpy.bool_(True), 'text')
+    results = sink.results()
+    assert [(row['Actual'], row['Expect']) for row in results] == \
+        [(5, 5), (1.5, 1.5), (Decimal('1.10'), None), (True, 'text')]
+    assert [(type(row['Actual']), type(row['Expect'])) for row in results] == \
+        [(int, int), (float, float), (Decimal, type(None)), (bool, str)]
+
+
+def test_discard_removes_files(tmp_path):
+    dirpath = tmp_path / 'results'
+    sink = ResultSink(dirpath=str(dirpath))
+    sink.add('scenario', 1, 1).flush()
+    assert ResultSink.workerFiles(str(dirpath))
+    sink.discard()
+    assert not dirpath.exists()
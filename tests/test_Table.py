@@ -0,0 +1,72 @@
+import pytest
+from pandas import DataFrame, NA, Series
+from sqlalchemy import create_engine, text
+from core.libs.HTMLParser import HtmlParser
+from core.models.Table import Table
+
+HTML = '''<table>
+<tr><th>id</th><th>name</th><th>price</th></tr>
+<tr><td>1</td><td>apple</td><td>1.5</td></tr>
+<tr><td>2</td><td>pear</td><td>2.0</td></tr>
+<tr><td>3</td><td>plum</td><td>3.5</td></tr>
+</table>'''
+
+
+def nullable_tables():
+    actual = Table(DataFrame({'id': [1, 2, 3, 4],
+                              'qty': Series([NA, 5, 7, NA], dtype='Int64'),
+                              'price': Series([1.0, NA, 2.0, 3.0], dtype='Float64')}))
+    expect = Table(DataFrame({'id': [1, 2, 3, 4],
+                              'qty': Series([5, 5, NA, NA], dtype='Int64'),
+                              'price': Series([1.0, 2.0, 2.0, 3.0], dtype='Float64')}))
+    return actual, expect
+
+
+def test_diff_nullable_one_sided_na_is_different():
+    actual, expect = nullable_tables()
+    diff = actual.diff(expect, 'id')
+    assert not diff.is_equal
+    assert diff.mask['qty'].tolist() == [True, False, True, False]
+    assert diff.mask['price'].tolist() == [False, True, False, False]
+    assert diff.summary() == {'added': 0, 'removed': 0, 'changed': 3, 'cells': 3}
+
+
+def test_diff_nullable_with_tolerance():
+    actual, expect = nullable_tables()
+    diff = actual.diff(expect, 'id', tolerance=0.5)
+    assert diff.mask['qty'].tolist() == [True, False, True, False]
+    assert diff.mask['price'].tolist() == [False, True, False, False]
+
+
+def test_diff_nullable_equal_tables():
+    actual, expect = nullable_tables()
+    diff = actual.diff(Table(actual.copy()), 'id')
+    assert diff.is_equal
+    assert diff.summary()['cells'] == 0
+
+
+def test_diff_parsed_html_against_cursor_table():
+    actual = HtmlParser.get_html_content(HTML).parse_table(dtypes='infer')
+    engine = create_engine('sqlite://')
+    with engine.connect() as connection:
+        # REAL ids read back as 1.0, 2.0... while html ids are inferred as int64
+        connection.execute(text('CREATE TABLE fruits (id REAL, name TEXT, price REAL)'))
+        connection.execute(text("INSERT INTO fruits VALUES (1, 'apple', 1.5), (2, 'pear', 2.5), (4, 'fig', 4.0)"))
+        expect = Table.from_cursor(connection.execute(text('SELECT id, name, price FROM fruits')))
+    assert actual['id'].dtype.kind == 'i' and expect['id'].dtype.kind == 'f'
+    diff = actual.diff(expect, 'id')
+    assert diff.summary() == {'added': 1, 'removed': 1, 'changed': 1, 'cells': 1}
+    assert diff.changed['price_expect'].tolist() == [2.5]
+
+
+def test_diff_object_keys_match_numeric_keys():
+    actual = Table(DataFrame({'id': Series([1, 2], dtype=object), 'qty': [5, 6]}))
+    expect = Table(DataFrame({'id': [1, 2], 'qty': [5, 6]}))
+    assert actual.diff(expect, 'id').is_equal
+
+
+def test_diff_incompatible_keys():
+    actual = Table(DataFrame({'id': ['a', 'b'], 'qty': [5, 6]}))
+    expect = Table(DataFrame({'id': [1, 2], 'qty': [5, 6]}))
+    with pytest.raises(ValueError):
+        actual.diff(expect, 'id')